@@ -8,7 +8,9 @@ from discord.ext import commands
 from datetime import timedelta
 from discord.ui import Select, View, Button
 
-from data import active_duels, save_active_duels, update_stats
+from data import active_duels, save_active_duels, update_stats, gateway, outbox, reconciled, periods_reconciled
+from scheduler import scheduler
+from dm_fanout import fanout
 
 
 # --- логгер ---
@@ -81,6 +83,42 @@ class Admin(commands.Cog):
         view = DuelSelectionView(ctx, valid_duels)
         await ctx.send("Выберите дуэль:", view=view, ephemeral=True)
 
+    # --- /диагностика ---
+    @app_commands.command(name="диагностика", description="Состояние базы данных и очереди записи")
+    async def diagnostics(self, interaction: discord.Interaction):
+
+        logger.info(f"/диагностика вызвал {interaction.user}")
+
+        if not interaction.user.guild_permissions.manage_guild:
+            return await interaction.response.send_message("❌ Нет прав", ephemeral=True)
+
+        queue = outbox.stats()
+        embed = discord.Embed(title="🩺 Диагностика данных", color=discord.Color.blurple())
+        embed.add_field(name="🔌 Предохранители Supabase", value="\n".join(gateway.health())[:1024], inline=False)
+        embed.add_field(
+            name="📮 Очередь записи",
+            value=f"в очереди {queue['depth']}, отправлено {queue['sent']}, ошибок подряд {queue['failures']}, "
+                  f"отвергнуто базой {queue['dead']}",
+            inline=False
+        )
+        embed.add_field(
+            name="🔄 Сверка с базой",
+            value=("выполнена" if reconciled.is_set() else "ещё не удалась — работаем по локальному снимку")
+                  + ("" if periods_reconciled.is_set() else "; статистика по периодам ещё не загружена"),
+            inline=False
+        )
+        latency = gateway.describe()
+        if latency:
+            embed.add_field(name="⏱ Задержки запросов", value="\n".join(latency)[:1024], inline=False)
+        jobs = scheduler.describe()
+        if jobs:
+            embed.add_field(name="🗓 Планировщик", value="\n".join(jobs)[:1024], inline=False)
+        deliveries = fanout.describe()
+        if deliveries:
+            embed.add_field(name="✉️ Доставка ЛС", value="\n".join(deliveries)[:1024], inline=False)
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
     # --- /изгнание ---
     @app_commands.command(name="изгнание")
     async def banish(self, interaction: discord.Interaction, member: discord.Member):
@@ -252,14 +290,20 @@ class DuelSelectionView(View):
 
         await interaction.response.send_message(
             "Кто победил?",
-            view=WinnerButtonsView(duel_id, self.ctx.bot),
+            view=WinnerButtonsView(duel_id, self.ctx.bot, interaction.guild),
             ephemeral=True
         )
 
 
 # --- WINNER ---
+def current_name(guild, user_id, fallback):
+    """Актуальный ник участника; сохранённое в дуэли имя — если его нет на сервере."""
+    member = guild.get_member(user_id) if guild else None
+    return member.display_name if member else fallback
+
+
 class WinnerButtonsView(View):
-    def __init__(self, duel_id, bot):
+    def __init__(self, duel_id, bot, guild=None):
         super().__init__()
         self.duel_id = duel_id
         self.bot = bot
@@ -268,16 +312,16 @@ class WinnerButtonsView(View):
         if not duel:
             return
 
-        p1 = duel["player1"]
-        p2 = duel["player2"]
-
-        self.add_item(self.WinnerButton(duel_id, p1))
-        self.add_item(self.WinnerButton(duel_id, p2))
+        self.add_item(self.WinnerButton(duel_id, duel["challenger_id"],
+                                        current_name(guild, duel["challenger_id"], duel["player1"])))
+        self.add_item(self.WinnerButton(duel_id, duel["opponent_id"],
+                                        current_name(guild, duel["opponent_id"], duel["player2"])))
 
     class WinnerButton(Button):
-        def __init__(self, duel_id, name):
+        def __init__(self, duel_id, user_id, name):
             super().__init__(label=name, style=discord.ButtonStyle.success)
             self.duel_id = duel_id
+            self.user_id = user_id
             self.name = name
 
         async def callback(self, interaction: discord.Interaction):
@@ -288,18 +332,21 @@ class WinnerButtonsView(View):
                 logger.warning("duel already finished")
                 return await interaction.response.send_message("уже завершено", ephemeral=True)
 
-            p1 = duel["player1"]
-            p2 = duel["player2"]
+            if self.user_id == duel["challenger_id"]:
+                loser_id, loser = duel["opponent_id"], duel["player2"]
+            else:
+                loser_id, loser = duel["challenger_id"], duel["player1"]
 
-            loser = p2 if self.name == p1 else p1
+            winner = current_name(interaction.guild, self.user_id, self.name)
+            loser = current_name(interaction.guild, loser_id, loser)
 
-            update_stats(self.name, loser)
+            update_stats(self.user_id, winner, loser_id, loser)
             await save_active_duels(self.view.bot)
 
-            logger.success(f"{self.name} победил")
+            logger.success(f"{winner} победил")
 
             await interaction.response.send_message(
-                f"🏆 {self.name} победил, {loser} проиграл"
+                f"🏆 {winner} победил, {loser} проиграл"
             )
 
 
@@ -3,6 +3,8 @@ from discord import app_commands
 from discord.ext import commands
 import logging
 
+from dm_fanout import fanout
+
 # 🔥 твоя система логов
 logger = logging.getLogger("bot.applications")
 logger.setLevel(logging.DEBUG)
@@ -144,7 +146,7 @@ class Applications(commands.Cog):
             )
 
             if guild:
-                notified = set()
+                staff = []
 
                 for role_id in self.NOTIFY_ROLE_IDS:
                     role = guild.get_role(role_id)
@@ -152,19 +154,14 @@ class Applications(commands.Cog):
                         logger.warning(f"Роль не найдена: {role_id}")
                         continue
 
-                    for member in role.members:
-                        if member.bot or member.id in notified:
-                            continue
-
-                        try:
-                            dm_member = await member.create_dm()
-                            await dm_member.send(
-                                f"📩 Новая заявка: {interaction.user.mention}\n{msg.jump_url}"
-                            )
-                            notified.add(member.id)
-                            logger.info(f"📢 Уведомлён: {member}")
-                        except Exception as e:
-                            logger.warning(f"Не удалось уведомить {member}: {e}")
+                    staff.extend(member for member in role.members if not member.bot)
+
+                await fanout.send(
+                    self.bot,
+                    staff,
+                    f"📩 Новая заявка: {interaction.user.mention}\n{msg.jump_url}",
+                    name="applications"
+                )
 
         except Exception as e:
             logger.error(f"Ошибка заявки: {e}")
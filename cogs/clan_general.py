@@ -6,6 +6,15 @@ import data
 
 logger = logging.getLogger("ClanGeneral")
 
+STATS_PAGE_SIZE = 20
+ALL_TIME = "всё время"
+PERIOD_TITLES = {
+    ALL_TIME: "Общая статистика дуэлей",
+    "день": "Статистика дуэлей за сегодня",
+    "неделя": "Статистика дуэлей за неделю",
+    "месяц": "Статистика дуэлей за месяц",
+}
+
 
 class ClanGeneral(commands.Cog):
     def __init__(self, bot):
@@ -16,16 +25,21 @@ class ClanGeneral(commands.Cog):
     async def stats_command(self, ctx: commands.Context, user: discord.Member):
         try:
             stats_data = await data.get_stats()
-            user_key = data.key_from_name(user.display_name)
-            user_stats = stats_data.get(user_key, {"wins": 0, "losses": 0, "display_name": user.display_name})
-
-            display_name = user_stats.get("display_name", user.display_name)
+            record = stats_data.get(user.id)
 
-            await ctx.send(
-                f"📊 Статистика {display_name}:\n"
-                f"Победы: {user_stats.get('wins', 0)}\n"
-                f"Поражения: {user_stats.get('losses', 0)}"
-            )
+            if record is None:
+                await ctx.send(
+                    f"📊 Статистика {user.display_name}:\n"
+                    f"Победы: 0\n"
+                    f"Поражения: 0"
+                )
+            else:
+                await ctx.send(
+                    f"📊 Статистика {user.display_name}:\n"
+                    f"Победы: {record.wins}\n"
+                    f"Поражения: {record.losses}\n"
+                    f"Место в рейтинге: {stats_data.rank(user.id)} из {len(stats_data)}"
+                )
             logger.info(f"{ctx.author} запросил статистику для {user}")
         except Exception as e:
             logger.error(f"Ошибка при получении статистики для {user}: {e}")
@@ -33,31 +47,37 @@ class ClanGeneral(commands.Cog):
 
     # --- /общая_статистика ---
     @app_commands.command(name="общая_статистика", description="Показать статистику по всем участникам")
-    async def all_stats(self, interaction: discord.Interaction):
+    @app_commands.describe(страница="Номер страницы рейтинга", период="За какое время считать")
+    @app_commands.choices(период=[
+        app_commands.Choice(name=title, value=period) for period, title in PERIOD_TITLES.items()
+    ])
+    async def all_stats(self, interaction: discord.Interaction, страница: int = 1, период: str = ALL_TIME):
         try:
             # Откладываем ответ, чтобы безопасно отправлять followup
             await interaction.response.defer(thinking=True)
             
-            stats_data = await data.get_stats()
-            if not stats_data:
+            if период == ALL_TIME:
+                # Рейтинг уже отсортирован — берём только нужную страницу
+                stats_data = await data.get_stats()
+                rows, pages = stats_data.page(страница, STATS_PAGE_SIZE)
+            else:
+                # Сумма дневных корзин за период
+                records = data.period_stats.leaderboard(период)
+                pages = max(1, -(-len(records) // STATS_PAGE_SIZE))
+                offset = (min(max(1, страница), pages) - 1) * STATS_PAGE_SIZE
+                rows = list(enumerate(records[offset:offset + STATS_PAGE_SIZE], offset + 1))
+
+            if not rows:
                 await interaction.followup.send("📉 Пока нет данных о боях.")
-                logger.info(f"{interaction.user} вызвал общую статистику, но данных нет")
+                logger.info(f"{interaction.user} вызвал статистику ({период}), но данных нет")
                 return
 
-            stats_list = []
-            for user_key, user_data in stats_data.items():
-                display_name = user_data.get("display_name", user_key)
-                wins = user_data.get("wins", 0)
-                losses = user_data.get("losses", 0)
-                total = wins + losses
-                stats_list.append((display_name, wins, losses, total))
-
-            # Сортируем по победам
-            stats_list.sort(key=lambda x: x[1], reverse=True)
-
-            lines = ["**🏆 Общая статистика дуэлей:**\n"]
-            for i, (name, wins, losses, total) in enumerate(stats_list, 1):
-                lines.append(f"{i}. **{name}** — 🟢 Побед: {wins}, 🔴 Поражений: {losses}, ⚔ Всего: {total}")
+            lines = [f"**🏆 {PERIOD_TITLES[период]}:**\n"]
+            for i, record in rows:
+                lines.append(
+                    f"{i}. **{record.display_name}** — 🟢 Побед: {record.wins}, "
+                    f"🔴 Поражений: {record.losses}, ⚔ Всего: {record.total}"
+                )
 
             embed = discord.Embed(
                 title="📊 Статистика дуэлей",
@@ -65,13 +85,13 @@ class ClanGeneral(commands.Cog):
                 color=discord.Color.gold()
             )
             embed.set_footer(
-                text=f"Запрошено: {interaction.user.display_name}",
+                text=f"Страница {min(max(1, страница), pages)} из {pages} • Запрошено: {interaction.user.display_name}",
                 icon_url=interaction.user.display_avatar.url
             )
             embed.timestamp = discord.utils.utcnow()
 
             await interaction.followup.send(embed=embed)
-            logger.info(f"{interaction.user} успешно вызвал общую статистику")
+            logger.info(f"{interaction.user} успешно вызвал статистику ({период})")
         except Exception as e:
             logger.error(f"Ошибка при формировании общей статистики: {e}")
             try:
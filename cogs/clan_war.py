@@ -1,19 +1,84 @@
 import asyncio
 import random
 import json
-import os
 from datetime import datetime
+from functools import partial
 
 import discord
 from discord import app_commands
-from discord.ext import commands, tasks
+from discord.ext import commands
 import logging
 
+from data import store
+from config import default_timezone
+from scheduler import scheduler
+from dm_fanout import fanout
+
 logger = logging.getLogger("bot.clan_war")
 logger.setLevel(logging.INFO)
 logger.propagate = True
 
 
+class CWSubscriptions:
+    """
+    Подписки на КВ в двух видах: участник -> его КВ и обратный индекс
+    КВ -> подписчики. Рассылка берёт подписчиков одним обращением к индексу,
+    а прошедшие КВ удаляются целиком вместе со своим списком.
+    """
+
+    def __init__(self):
+        self.by_user = {}   # user_id -> {cw_id}
+        self.by_event = {}  # cw_id -> {user_id}
+
+    def load(self, data):
+        """data — {user_id: [cw_id, ...]} из хранилища."""
+        self.by_user, self.by_event = {}, {}
+        for uid, cw_ids in data.items():
+            for cw_id in cw_ids:
+                self.subscribe(int(uid), cw_id)
+
+    def is_subscribed(self, user_id, cw_id):
+        return user_id in self.by_event.get(cw_id, ())
+
+    def subscribe(self, user_id, cw_id):
+        """False, если участник уже был подписан."""
+        if self.is_subscribed(user_id, cw_id):
+            return False
+        self.by_user.setdefault(user_id, set()).add(cw_id)
+        self.by_event.setdefault(cw_id, set()).add(user_id)
+        return True
+
+    def unsubscribe(self, user_id, cw_id):
+        """False, если подписки не было."""
+        if not self.is_subscribed(user_id, cw_id):
+            return False
+        self._discard(self.by_event, cw_id, user_id)
+        self._discard(self.by_user, user_id, cw_id)
+        return True
+
+    def subscribers(self, cw_id):
+        return self.by_event.get(cw_id, set())
+
+    def events(self, user_id):
+        return self.by_user.get(user_id, set())
+
+    def expire_before(self, cw_id):
+        """Удаляет все КВ раньше cw_id; возвращает затронутых участников."""
+        changed = set()
+        for old in [event for event in self.by_event if event < cw_id]:
+            for user_id in self.by_event.pop(old):
+                self._discard(self.by_user, user_id, old)
+                changed.add(user_id)
+        return changed
+
+    @staticmethod
+    def _discard(index, key, value):
+        values = index[key]
+        values.discard(value)
+        if not values:
+            del index[key]
+
+
 class CWNotificationView(discord.ui.View):
     def __init__(self, cog, cw_id: str):
         super().__init__(timeout=None)
@@ -28,18 +93,14 @@ class CWNotificationView(discord.ui.View):
     async def subscribe_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         user_id = interaction.user.id
 
-        if user_id not in self.cog.subscribed_users:
-            self.cog.subscribed_users[user_id] = set()
-
-        if self.cw_id in self.cog.subscribed_users[user_id]:
+        if not self.cog.subscriptions.subscribe(user_id, self.cw_id):
             await interaction.response.send_message(
                 "ℹ️ Ты уже подписан на это КВ.",
                 ephemeral=True
             )
             return
 
-        self.cog.subscribed_users[user_id].add(self.cw_id)
-        self.cog.save_subs()
+        self.cog.save_subs(user_id)
 
         await interaction.response.send_message(
             "✅ Ты записан на это КВ.",
@@ -54,17 +115,15 @@ class CWNotificationView(discord.ui.View):
     async def unsubscribe_button(self, interaction: discord.Interaction, button: discord.ui.Button):
         user_id = interaction.user.id
 
-        if user_id not in self.cog.subscribed_users:
+        if not self.cog.subscriptions.events(user_id):
             await interaction.response.send_message(
                 "ℹ️ Ты не записан.",
                 ephemeral=True
             )
             return
 
-        if self.cw_id in self.cog.subscribed_users[user_id]:
-            self.cog.subscribed_users[user_id].remove(self.cw_id)
-
-        self.cog.save_subs()
+        if self.cog.subscriptions.unsubscribe(user_id, self.cw_id):
+            self.cog.save_subs(user_id)
 
         await interaction.response.send_message(
             "❌ Ты отписался от этого КВ.",
@@ -73,6 +132,13 @@ class CWNotificationView(discord.ui.View):
 
 
 class ClanWarNotifications(commands.Cog):
+    # (час, минута, метка, текст) — личные уведомления подписчикам в день КВ
+    cw_events = [
+        (20, 30, "start", "⚔️ Сетка КВ началась!"),
+        (20, 50, "warn", "⏳ До КВ осталось 10 минут!"),
+        (21, 0, "go", "🔥 КВ НАЧАЛОСЬ!")
+    ]
+
     def __init__(self, bot):
         self.bot = bot
 
@@ -80,13 +146,17 @@ class ClanWarNotifications(commands.Cog):
         self.announcements_channel_id = 1368378026466738300
         self.role_id = 1472318342663507988
 
-        self.subscribed_users = {}
-        self.subs_file = "data/cw_subs.json"
+        self.subscriptions = CWSubscriptions()
+        self.subs_file = "data/cw_subs.json"  # старый файл, переносится в хранилище
 
         self.off_days = set()
-        self.off_days_file = "data/off_days.json"
+        self.off_days_file = "data/off_days.json"  # старый файл, переносится в хранилище
 
-        self.sent_events = set()
+        # изменения копятся в памяти и записываются одной пачкой через flush_delay секунд
+        self.pending_subs = set()      # user_id
+        self.pending_off_days = {}     # дата -> причина (None — удалить)
+        self.flush_delay = 2
+        self.flush_task = None
 
         self.images = [
             "https://cdn.discordapp.com/attachments/1355929392072753262/1502054043780911175/929cfe4e32658036984c4de7b3446343.jpg?ex=6a078ad6&is=6a063956&hm=950f7d12140f88ff6a06758476e0e3c5c87d031041109500e4b00b6b37214153&",
@@ -102,100 +172,112 @@ class ClanWarNotifications(commands.Cog):
             "https://cdn.discordapp.com/attachments/1297692294878859314/1427698466267599021/-__.png"
         )
 
-        self.load_subs()
-        self.cleanup_old_subs()
-        self.load_off_days()
-        self.cleanup_old_off_days()
+    async def cog_load(self):
+        await store.import_file("cw_subs", self.subs_file, json.loads)
+        await store.import_file(
+            "cw_off_days", self.off_days_file,
+            lambda text: {day: "Выходной" for day in json.loads(text)}
+        )
+
+        await self.load_subs()
+        await self.cleanup_old_subs()
+        await self.load_off_days()
+        await self.cleanup_old_off_days()
 
-        self.daily_announcement.start()
-        self.cw_notifications.start()
+        await scheduler.daily("cw:daily", self.daily_announcement, hour=12, grace=3600)
+        await scheduler.daily("cw:cleanup", self.daily_cleanup, hour=0, minute=5, grace=None)
+        for hour, minute, tag, msg in self.cw_events:
+            await scheduler.daily(f"cw:{tag}", partial(self.cw_notification, msg), hour=hour, minute=minute)
 
         logger.info("⚔️ ClanWarNotifications загружен")
 
+    async def cog_unload(self):
+        scheduler.cancel("cw:daily")
+        scheduler.cancel("cw:cleanup")
+        for _, _, tag, _ in self.cw_events:
+            scheduler.cancel(f"cw:{tag}")
+
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        await self.flush()
+
+    # ------------------- Запись в хранилище -------------------
+    def schedule_flush(self):
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # пока ждали, могли прийти новые изменения — пишем, пока очередь не опустеет
+        while self.pending_subs or self.pending_off_days:
+            await asyncio.sleep(self.flush_delay)
+            await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные изменения подписок и выходных."""
+        subs, self.pending_subs = self.pending_subs, set()
+        off_days, self.pending_off_days = self.pending_off_days, {}
+
+        if subs:
+            upserts, deletes = {}, []
+            for uid in subs:
+                cw_ids = self.subscriptions.events(uid)
+                if cw_ids:
+                    upserts[uid] = sorted(cw_ids)
+                else:
+                    deletes.append(uid)
+            try:
+                await store.write("cw_subs", upserts, deletes)
+            except Exception as e:
+                logger.error(f"❌ ошибка сохранения подписок: {e}")
+                self.pending_subs |= subs
+
+        if off_days:
+            upserts = {day: reason for day, reason in off_days.items() if reason is not None}
+            deletes = [day for day, reason in off_days.items() if reason is None]
+            try:
+                await store.write("cw_off_days", upserts, deletes)
+            except Exception as e:
+                logger.error(f"❌ ошибка сохранения выходных: {e}")
+                # более свежие изменения тех же дат важнее
+                self.pending_off_days = {**off_days, **self.pending_off_days}
+
     # ------------------- Подписки -------------------
-    def load_subs(self):
+    async def load_subs(self):
         try:
-            if not os.path.exists(self.subs_file):
-                self.subscribed_users = {}
-                return
-
-            with open(self.subs_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-
-            self.subscribed_users = {
-                int(uid): set(cw_ids)
-                for uid, cw_ids in data.items()
-            }
+            self.subscriptions.load(await store.items("cw_subs"))
 
         except Exception as e:
             logger.error(f"❌ ошибка загрузки подписок: {e}")
-            self.subscribed_users = {}
-
-    def save_subs(self):
-        try:
-            os.makedirs(os.path.dirname(self.subs_file), exist_ok=True)
-
-            data = {
-                str(uid): list(cw_ids)
-                for uid, cw_ids in self.subscribed_users.items()
-            }
-
-            with open(self.subs_file, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            self.subscriptions = CWSubscriptions()
 
-        except Exception as e:
-            logger.error(f"❌ ошибка сохранения подписок: {e}")
-
-    def cleanup_old_subs(self):
-        today = datetime.now().strftime("%Y-%m-%d")
-        changed = False
-
-        for uid in list(self.subscribed_users.keys()):
-            cw_ids = self.subscribed_users[uid]
+    def save_subs(self, *user_ids):
+        """Помечает подписки участников к записи (пустые будут удалены)."""
+        self.pending_subs.update(user_ids)
+        self.schedule_flush()
 
-            new_set = {cw for cw in cw_ids if cw >= today}
-
-            if new_set != cw_ids:
-                self.subscribed_users[uid] = new_set
-                changed = True
-
-            if not self.subscribed_users[uid]:
-                del self.subscribed_users[uid]
-                changed = True
+    async def cleanup_old_subs(self):
+        today = datetime.now(default_timezone()).strftime("%Y-%m-%d")
+        changed = self.subscriptions.expire_before(today)
 
         if changed:
-            self.save_subs()
+            self.save_subs(*changed)
 
     # ------------------- Выходные дни -------------------
-    def load_off_days(self):
+    async def load_off_days(self):
         try:
-            if not os.path.exists(self.off_days_file):
-                self.off_days = set()
-                return
-
-            with open(self.off_days_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                self.off_days = set(data)
+            self.off_days = set(await store.items("cw_off_days"))
 
         except Exception as e:
             logger.error(f"❌ ошибка загрузки выходных: {e}")
             self.off_days = set()
 
-    def save_off_days(self):
-        try:
-            os.makedirs(os.path.dirname(self.off_days_file), exist_ok=True)
-            with open(self.off_days_file, "w", encoding="utf-8") as f:
-                json.dump(list(self.off_days), f, indent=2, ensure_ascii=False)
-
-        except Exception as e:
-            logger.error(f"❌ ошибка сохранения выходных: {e}")
-
-    def cleanup_old_off_days(self):
-        today = datetime.now().strftime("%Y-%m-%d")
+    async def cleanup_old_off_days(self):
+        today = datetime.now(default_timezone()).strftime("%Y-%m-%d")
         old = {d for d in self.off_days if d < today}
         if old:
             self.off_days -= old
-            self.save_off_days()
+            self.pending_off_days.update(dict.fromkeys(old))
+            self.schedule_flush()
 
     # ------------------- Команда /выходной -------------------
     @app_commands.command(name="выходной", description="Объявить выходной день (КВ отменяется)")
@@ -219,7 +301,7 @@ class ClanWarNotifications(commands.Cog):
 
         # Определяем дату
         if дата is None:
-            target_date = datetime.now().strftime("%Y-%m-%d")
+            target_date = datetime.now(default_timezone()).strftime("%Y-%m-%d")
         else:
             try:
                 datetime.strptime(дата, "%Y-%m-%d")
@@ -239,7 +321,8 @@ class ClanWarNotifications(commands.Cog):
             return
 
         self.off_days.add(target_date)
-        self.save_off_days()
+        self.pending_off_days[target_date] = причина
+        self.schedule_flush()
 
         channel = self.bot.get_channel(self.announcements_channel_id)
         if channel:
@@ -260,38 +343,23 @@ class ClanWarNotifications(commands.Cog):
 
     # ------------------- Рассылка уведомлений -------------------
     async def send_dm_to_members(self, cw_id: str, text: str):
-        sent = 0
-        failed = 0
-
-        for uid, cw_ids in self.subscribed_users.items():
-            if cw_id not in cw_ids:
-                continue
-
-            try:
-                user = await self.bot.fetch_user(uid)
-                await user.send(f"{user.mention} {text}")
-                sent += 1
-                await asyncio.sleep(0.25)
-            except Exception:
-                failed += 1
-
-        logger.info(f"📊 DM {cw_id} | sent={sent} failed={failed}")
+        recipients = self.subscriptions.subscribers(cw_id)
+        result = await fanout.send(self.bot, recipients, lambda user: f"{user.mention} {text}", name="cw")
+        logger.info(f"📊 DM {cw_id} | sent={result['sent']} failed={result['failed']} closed={result['closed']}")
 
     # ------------------- Задачи -------------------
-    @tasks.loop(seconds=10)
-    async def daily_announcement(self):
-        now = datetime.now()
-        cw_id = now.strftime("%Y-%m-%d")
-        key = f"daily:{cw_id}"
+    async def daily_cleanup(self, when: datetime):
+        """Прошедшие КВ и выходные убираются сразу после полуночи."""
+        await self.cleanup_old_subs()
+        await self.cleanup_old_off_days()
 
-        if key in self.sent_events:
-            return
-
-        if now.hour != 12 or now.minute != 0:
-            return
+    async def daily_announcement(self, when: datetime):
+        await self.bot.wait_until_ready()
+        cw_id = when.strftime("%Y-%m-%d")
 
         channel = self.bot.get_channel(self.announcements_channel_id)
         if not channel:
+            logger.warning(f"Канал {self.announcements_channel_id} не найден, анонс КВ не отправлен")
             return
 
         # Если выходной — отправляем сообщение об отмене
@@ -302,10 +370,9 @@ class ClanWarNotifications(commands.Cog):
                 color=discord.Color.orange()
             )
             await channel.send(content=f"<@&{self.role_id}>", embed=embed)
-            self.sent_events.add(key)
             return
 
-        weekday = now.weekday()
+        weekday = when.weekday()
         status = "🟥 Обязательное КВ" if weekday in [0, 1, 2, 6] else "🟩 Необязательное КВ"
 
         embed = discord.Embed(
@@ -325,39 +392,14 @@ class ClanWarNotifications(commands.Cog):
             view=view
         )
 
-        self.sent_events.add(key)
-
-    @tasks.loop(seconds=10)
-    async def cw_notifications(self):
-        now = datetime.now()
-        cw_id = now.strftime("%Y-%m-%d")
+    async def cw_notification(self, text: str, when: datetime):
+        await self.bot.wait_until_ready()
+        cw_id = when.strftime("%Y-%m-%d")
 
         if cw_id in self.off_days:
             return
 
-        events = [
-            (20, 30, "start", "⚔️ Сетка КВ началась!"),
-            (20, 50, "warn", "⏳ До КВ осталось 10 минут!"),
-            (21, 0, "go", "🔥 КВ НАЧАЛОСЬ!")
-        ]
-
-        for hour, minute, tag, msg in events:
-            key = f"{cw_id}:{tag}"
-
-            if key in self.sent_events:
-                continue
-
-            if now.hour == hour and now.minute == minute:
-                await self.send_dm_to_members(cw_id, msg)
-                self.sent_events.add(key)
-
-    @daily_announcement.before_loop
-    async def before_daily_loop(self):
-        await self.bot.wait_until_ready()
-
-    @cw_notifications.before_loop
-    async def before_cw_loop(self):
-        await self.bot.wait_until_ready()
+        await self.send_dm_to_members(cw_id, text)
 
 
 async def setup(bot):
@@ -4,7 +4,7 @@ from discord.ui import Button, View, Select
 from datetime import datetime
 import asyncio
 
-from data import active_duels, save_active_duels, update_stats, load_data, stats
+from data import active_duels, save_active_duels, update_stats, load_data, migrate_to_user_ids, reconciled, periods_reconciled
 from cogs.voting import VotingView  # внешний ког для голосований
 
 # --- Основной класс дуэлей ---
@@ -12,6 +12,17 @@ class Duel(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # старые строки по именам переносим, когда участники серверов уже известны
+        # и данные сверены с Supabase
+        await reconciled.wait()
+        await migrate_to_user_ids(self.bot)
+        # статистика по периодам сверяется отдельно и может прийти позже
+        if not periods_reconciled.is_set():
+            await periods_reconciled.wait()
+            await migrate_to_user_ids(self.bot)
+
     @commands.hybrid_command(name="дуэль", description="Вызвать пользователя на дуэль")
     async def duel(self, ctx: commands.Context, user: discord.Member, game: str, time: str):
         challenger = ctx.author
@@ -78,10 +89,12 @@ class AcceptDuelView(View):
                     "Только вызванный может принять вызов!", ephemeral=True
                 )
 
-            duel_id = f"{challenger.display_name}-{opponent.display_name}"
+            duel_id = f"{challenger.id}-{opponent.id}"
             active_duels[duel_id] = {
                 "player1": challenger.display_name,
                 "player2": opponent.display_name,
+                "challenger_id": challenger.id,
+                "opponent_id": opponent.id,
                 "game": game,
                 "time": time,
                 "status": "active",
@@ -137,8 +150,8 @@ class DuelSelectionView(View):
             opponent_name = duel.get("player2")
             if not challenger_name or not opponent_name:
                 continue
-            challenger = discord.utils.get(guild.members, name=challenger_name)
-            opponent = discord.utils.get(guild.members, name=opponent_name)
+            challenger = guild.get_member(duel.get("challenger_id"))
+            opponent = guild.get_member(duel.get("opponent_id"))
             label = f"{challenger.display_name if challenger else challenger_name} vs {opponent.display_name if opponent else opponent_name}"
             self.select.add_option(label=label, value=duel_id)
 
@@ -157,8 +170,8 @@ class DuelSelectionView(View):
         guild = interaction.guild
         challenger_name = duel.get("player1")
         opponent_name = duel.get("player2")
-        challenger = discord.utils.get(guild.members, name=challenger_name)
-        opponent = discord.utils.get(guild.members, name=opponent_name)
+        challenger = guild.get_member(duel.get("challenger_id"))
+        opponent = guild.get_member(duel.get("opponent_id"))
 
         await interaction.response.send_message(
             f"Выбрана дуэль между {challenger.mention if challenger else challenger_name} и {opponent.mention if opponent else opponent_name}.\nКто победил?",
@@ -179,13 +192,16 @@ class WinnerButtonsView(View):
         self.player1 = duel.get("player1")
         self.player2 = duel.get("player2")
 
-        self.add_item(self.WinnerButton(duel_id, self.player1, bot, label=f"Победил {self.player1} 🟥"))
-        self.add_item(self.WinnerButton(duel_id, self.player2, bot, label=f"Победил {self.player2} 🟦"))
+        self.add_item(self.WinnerButton(duel_id, duel.get("challenger_id"), self.player1, bot,
+                                        label=f"Победил {self.player1} 🟥"))
+        self.add_item(self.WinnerButton(duel_id, duel.get("opponent_id"), self.player2, bot,
+                                        label=f"Победил {self.player2} 🟦"))
 
     class WinnerButton(Button):
-        def __init__(self, duel_id, winner_name, bot, label):
+        def __init__(self, duel_id, winner_id, winner_name, bot, label):
             super().__init__(label=label, style=discord.ButtonStyle.success)
             self.duel_id = duel_id
+            self.winner_id = winner_id
             self.winner_name = winner_name
             self.bot = bot
 
@@ -194,15 +210,21 @@ class WinnerButtonsView(View):
             if not duel:
                 return await interaction.response.send_message("Дуэль уже завершена.", ephemeral=True)
 
-            loser_name = duel["player2"] if self.winner_name == duel["player1"] else duel["player1"]
-
-            update_stats(self.winner_name, loser_name)
-            await save_active_duels(self.bot)
+            if self.winner_id == duel["challenger_id"]:
+                loser_id, loser_name = duel["opponent_id"], duel["player2"]
+            else:
+                loser_id, loser_name = duel["challenger_id"], duel["player1"]
 
-            # Получаем участников для упоминаний
+            # Получаем участников для упоминаний и актуальных имён
             guild = interaction.guild
-            winner_member = discord.utils.get(guild.members, name=self.winner_name)
-            loser_member = discord.utils.get(guild.members, name=loser_name)
+            winner_member = guild.get_member(self.winner_id)
+            loser_member = guild.get_member(loser_id)
+
+            update_stats(
+                self.winner_id, winner_member.display_name if winner_member else self.winner_name,
+                loser_id, loser_member.display_name if loser_member else loser_name
+            )
+            await save_active_duels(self.bot)
 
             await interaction.response.send_message(
                 f"🎉 Победитель: {winner_member.mention if winner_member else self.winner_name}!\n"
@@ -1,13 +1,17 @@
 import discord
 import logging
 from discord import app_commands
-from discord.ext import commands, tasks
+from discord.ext import commands
 import platform
 import psutil
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from functools import partial
+import itertools
 import json
 import os
 from config import load_config
+from data import store
+from scheduler import scheduler
 
 config = load_config()
 
@@ -20,36 +24,55 @@ logger = logging.getLogger("discord")
 BOT_VERSION = "3.9.9"
 
 DATA_DIR = "data"
-REMINDERS_FILE = os.path.join(DATA_DIR, "reminders.json")
+REMINDERS_FILE = os.path.join(DATA_DIR, "reminders.json")  # старый файл, переносится в хранилище
 
 user_reminders = {}
 
-def save_reminders():
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(REMINDERS_FILE, "w", encoding="utf-8") as f:
-        json.dump({
-            str(user_id): [(dt.isoformat(), msg) for dt, msg in reminders]
-            for user_id, reminders in user_reminders.items()
-        }, f, ensure_ascii=False, indent=4)
+async def save_reminders(*user_ids):
+    """Записывает напоминания указанных пользователей (пустые — удаляет)."""
+    upserts, deletes = {}, []
+    for user_id in user_ids:
+        reminders = user_reminders.get(user_id)
+        if reminders:
+            upserts[user_id] = [(dt.isoformat(), msg) for dt, msg in reminders]
+        else:
+            deletes.append(user_id)
+    try:
+        await store.write("reminders", upserts, deletes)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения напоминаний: {e}")
 
-def load_reminders():
+async def load_reminders():
     global user_reminders
+    await store.import_file("reminders", REMINDERS_FILE, json.loads)
     try:
-        with open(REMINDERS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            user_reminders = {
-                int(user_id): [(datetime.fromisoformat(dt), msg) for dt, msg in reminders]
-                for user_id, reminders in data.items()
-            }
-    except FileNotFoundError:
+        data = await store.items("reminders")
+        user_reminders = {
+            int(user_id): [(datetime.fromisoformat(dt), msg) for dt, msg in reminders]
+            for user_id, reminders in data.items()
+        }
+    except Exception as e:
+        logger.error(f"Ошибка загрузки напоминаний: {e}")
         user_reminders = {}
 
 class GeneralCommands(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.synced = False
-        load_reminders()
-        self.check_reminders.start()
+        self.reminder_ids = itertools.count()
+        self.reminder_jobs = set()
+
+    async def cog_load(self):
+        await load_reminders()
+        # просроченные за время простоя напоминания планировщик отправит сразу
+        for user_id, reminders in user_reminders.items():
+            for remind_time, message in reminders:
+                await self.schedule_reminder(user_id, remind_time, message)
+
+    async def cog_unload(self):
+        for name in self.reminder_jobs:
+            scheduler.cancel(name)
+        self.reminder_jobs.clear()
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -140,37 +163,40 @@ class GeneralCommands(commands.Cog):
         user_id = interaction.user.id
 
         user_reminders.setdefault(user_id, []).append((remind_time, message))
-        save_reminders()
+        await save_reminders(user_id)
+        await self.schedule_reminder(user_id, remind_time, message)
 
         await interaction.response.send_message(
             f"⏰ Напоминание через {minutes} минут: {message}",
             ephemeral=True
         )
 
-    @tasks.loop(seconds=30)
-    async def check_reminders(self):
-        now = datetime.utcnow()
+    async def schedule_reminder(self, user_id, remind_time, message):
+        name = f"reminder:{user_id}:{next(self.reminder_ids)}"
+        self.reminder_jobs.add(name)
+        await scheduler.once(
+            name,
+            partial(self.deliver_reminder, name, user_id, (remind_time, message)),
+            remind_time.replace(tzinfo=timezone.utc)
+        )
 
-        for user_id, reminders in list(user_reminders.items()):
-            for remind_time, message in reminders:
-                if now >= remind_time:
-                    user = self.bot.get_user(user_id)
-                    if user:
-                        try:
-                            await user.send(f"🔔 Напоминание: {message}")
-                        except:
-                            pass
-
-                    reminders.remove((remind_time, message))
-                    save_reminders()
-
-            if not reminders:
-                user_reminders.pop(user_id, None)
-                save_reminders()
-
-    @check_reminders.before_loop
-    async def before_check_reminders(self):
+    async def deliver_reminder(self, name, user_id, reminder, when):
+        self.reminder_jobs.discard(name)
         await self.bot.wait_until_ready()
 
+        user = self.bot.get_user(user_id)
+        if user:
+            try:
+                await user.send(f"🔔 Напоминание: {reminder[1]}")
+            except:
+                pass
+
+        reminders = user_reminders.get(user_id, [])
+        if reminder in reminders:
+            reminders.remove(reminder)
+        if not reminders:
+            user_reminders.pop(user_id, None)
+        await save_reminders(user_id)
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(GeneralCommands(bot))
\ No newline at end of file
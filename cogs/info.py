@@ -3,33 +3,30 @@ from discord import app_commands
 from discord.ext import commands
 import logging
 import json
-from supabase import create_client, Client
 from config import load_config
+from data import load_table
 
 # --- Логгер для InfoCog ---
 logger = logging.getLogger("Info")
 
 CONFIG = load_config()
 
-# --- Подключение к Supabase через конфиг ---
-supabase: Client = create_client(CONFIG["SUPABASE_URL"], CONFIG["SUPABASE_KEY"])
-
 
 class Info(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
-    def load_categories_from_db(self):
+    async def load_categories_from_db(self):
         """Загружаем категории и их содержимое из таблицы Supabase 'server_info'"""
         try:
-            response = supabase.table("server_info").select("*").execute()
+            rows = await load_table("server_info")
 
-            if not response.data:
+            if not rows:
                 logger.error("Данные из Supabase пустые или не найдены")
                 return {}
 
             categories = {}
-            for row in response.data:
+            for row in rows:
                 # Если content хранится как JSON-строка
                 if isinstance(row['content'], str):
                     try:
@@ -51,7 +48,7 @@ class Info(commands.Cog):
         description="Показывает информацию о сервере с выбором категории"
     )
     async def server_info(self, interaction: discord.Interaction):
-        categories = self.load_categories_from_db()
+        categories = await self.load_categories_from_db()
         if not categories:
             await interaction.response.send_message(
                 "Ошибка загрузки данных из базы!", ephemeral=True
@@ -2,22 +2,622 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 import asyncio
+import functools
+import hashlib
+import json
+import logging
 import yt_dlp
 import os
+import random
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import parse_qs, urlsplit
+from config import load_config
+from metrics import LatencyRegistry
+
+config = load_config()
+logger = logging.getLogger("Music")
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 FFMPEG_EXE = "ffmpeg"
 
-FFMPEG_OPTIONS = {'options': '-vn'}
+FFMPEG_OPTIONS = {
+    # подогретый заранее ffmpeg может долго простоять на паузе — разрешаем переподключение
+    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
+    'options': '-vn',
+}
+
+# Воспроизведение через FFmpegOpusAudio: discord.py отправляет готовые Opus-кадры
+# и не кодирует каждые 20 мс в своём процессе. False — старый путь через PCM.
+OPUS_PASSTHROUGH = True
+
+AUDIO_PATHS = {
+    'opus-copy': "Opus без перекодирования",
+    'opus-transcode': "перекодирование в Opus (ffmpeg)",
+    'pcm': "PCM (кодирование в боте)",
+    'opus-disk': "Opus из локального кэша",
+}
 
 YTDL_OPTIONS = {
-    'format': 'bestaudio/best',
+    # у SoundCloud есть Opus-потоки — берём их, чтобы ffmpeg мог просто перепаковать кадры
+    'format': 'bestaudio[acodec=opus]/bestaudio/best',
     'noplaylist': False,
     'quiet': True,
     'extract_flat': False,
     'default_search': 'scsearch',
+    'socket_timeout': 10,
 }
 
+# Для ссылок: записи плейлиста приходят «плоскими» (без потоков) и порциями,
+# поток каждого трека получаем только когда он подходит к воспроизведению
+YTDL_FLAT_OPTIONS = dict(YTDL_OPTIONS, extract_flat='in_playlist')
+PLAYLIST_CHUNK = 50  # сколько записей плейлиста забираем за один запрос
+
+# --- Локальный кэш аудио (выключен, если MUSIC_CACHE_DIR не задан) ---
+AUDIO_CACHE_DIR = config["MUSIC_CACHE_DIR"]
+AUDIO_CACHE_MAX_BYTES = config["MUSIC_CACHE_MAX_MB"] * 1024 * 1024
+AUDIO_CACHE_MIN_PLAYS = config["MUSIC_CACHE_MIN_PLAYS"]  # после стольких проигрываний трек сохраняется на диск
+AUDIO_CACHE_TRACKED = 2000     # сколько треков без файла помним ради счётчика проигрываний
+AUDIO_CACHE_TIMEOUT = 10 * 60  # предел на скачивание и перекодирование одного трека
+
+# Правки сообщения «Сейчас играет», пришедшие в пределах этого окна, сливаются в одну
+EMBED_DEBOUNCE = 1.5
+
+# --- Пул извлечения yt_dlp ---
+EXTRACT_WORKERS = 2        # одновременно работающих yt_dlp (RAM на Discloud — 100 МБ)
+EXTRACT_TIMEOUT = 30       # сколько секунд ждём один запрос, включая ожидание в очереди
+INTERACTION_TTL = 15 * 60  # токен interaction живёт 15 минут, дальше followup уже не отправить
+
+# --- Кэш результатов поиска и ссылок на поток ---
+CACHE_SIZE = 256            # записей в каждом из кэшей
+CACHE_TTL = 30 * 60         # если у ссылки нет срока действия
+STREAM_EXPIRY_MARGIN = 120  # запас до истечения подписанной ссылки SoundCloud
+
+# --- Предзагрузка следующих треков ---
+PREFETCH_AHEAD = 2      # для скольких треков вперёд заранее проверяем ссылку на поток
+PREFETCH_WARM_LEAD = 20 # за сколько секунд до конца трека запускаем ffmpeg для следующего
+
+
+def _extract_info(search, options):
+    """Выполняется в рабочем потоке: блокирующий вызов yt_dlp."""
+    with yt_dlp.YoutubeDL(options) as ydl:
+        return ydl.extract_info(search, download=False)
+
+
+def normalize_query(query):
+    """Ключ кэша для текстового запроса: регистр и лишние пробелы не важны."""
+    return " ".join(query.lower().split())
+
+
+def normalize_url(url):
+    """Ключ кэша для ссылки на страницу трека: без схемы, параметров и www/m."""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    return f"{host}{parts.path.rstrip('/')}".lower()
+
+
+def stream_ttl(url, default=CACHE_TTL):
+    """
+    Сколько секунд ещё можно пользоваться ссылкой на поток.
+    Подписанные ссылки SoundCloud содержат Expires (unix-время) в параметрах.
+    """
+    if not url:
+        return 0
+    params = parse_qs(urlsplit(url).query)
+    expires = params.get("Expires") or params.get("expires")
+    if not expires:
+        return default
+    try:
+        left = int(expires[0]) - time.time() - STREAM_EXPIRY_MARGIN
+    except ValueError:
+        return default
+    return max(0, min(default, left))
+
+
+class TTLCache:
+    """LRU-кэш с собственным временем жизни у каждой записи и счётчиками попаданий."""
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        item = self.data.get(key)
+        if item is not None and item[0] <= time.monotonic():
+            del self.data[key]
+            item = None
+
+        if item is None:
+            self.misses += 1
+            return None
+
+        self.data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self.data.pop(key, None)
+            return
+
+        self.data[key] = (time.monotonic() + ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key):
+        item = self.data.pop(key, None)
+        return item[1] if item else None
+
+    def stats(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return {"size": len(self.data), "hits": self.hits, "misses": self.misses, "hit_ratio": ratio}
+
+
+class AudioDiskCache:
+    """
+    Кэш Opus-файлов на диске для треков, которые на сервере крутят постоянно.
+    Файл появляется после AUDIO_CACHE_MIN_PLAYS проигрываний; при превышении
+    лимита по объёму удаляются файлы, которые дольше всех не играли.
+    Индекс со счётчиками лежит в index.json рядом с файлами.
+    """
+
+    def __init__(self, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES, min_plays=AUDIO_CACHE_MIN_PLAYS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.enabled = bool(directory)
+        # key -> {"file", "size", "plays", "hits"}; порядок — от давно игравших к недавним
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.pending = set()
+        self.slots = asyncio.Semaphore(1)  # один ffmpeg на запись — CPU на Discloud общий
+        self.save_task = None
+
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self.load_index()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"⚠️ Индекс аудио-кэша повреждён, начинаем заново: {e}")
+            return
+
+        for key, entry in entries:
+            if entry.get("file") and not os.path.exists(os.path.join(self.directory, entry["file"])):
+                entry["file"], entry["size"] = None, 0
+            self.entries[key] = entry
+            self.total_bytes += entry.get("size", 0)
+
+    def write_index(self, snapshot):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+
+    def schedule_save(self):
+        if self.save_task and not self.save_task.done():
+            return
+
+        async def save():
+            snapshot = [[key, dict(entry)] for key, entry in self.entries.items()]
+            try:
+                await asyncio.to_thread(self.write_index, snapshot)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось сохранить индекс аудио-кэша: {e}")
+
+        self.save_task = asyncio.create_task(save())
+
+    def key(self, track):
+        return normalize_url(track.webpage_url) if track.webpage_url else None
+
+    def path_for(self, track):
+        """Путь к локальному файлу трека или None."""
+        if not self.enabled:
+            return None
+
+        entry = self.entries.get(self.key(track))
+        if not entry or not entry.get("file"):
+            return None
+        return os.path.join(self.directory, entry["file"])
+
+    def record_play(self, track, from_disk):
+        """Считает проигрывание; на пороге AUDIO_CACHE_MIN_PLAYS ставит трек на запись в кэш."""
+        key = self.key(track)
+        if not self.enabled or not key:
+            return
+
+        entry = self.entries.setdefault(key, {"file": None, "size": 0, "plays": 0, "hits": 0})
+        self.entries.move_to_end(key)
+        entry["plays"] += 1
+        if from_disk:
+            entry["hits"] += 1
+        elif entry["plays"] >= self.min_plays and not entry["file"] and key not in self.pending and track.url:
+            self.pending.add(key)
+            asyncio.create_task(self.store(key, track.url, track.acodec))
+
+        self.trim_counters()
+        self.schedule_save()
+
+    def trim_counters(self):
+        uncached = [key for key, entry in self.entries.items() if not entry["file"]]
+        for key in uncached[:max(0, len(uncached) - AUDIO_CACHE_TRACKED)]:
+            del self.entries[key]
+
+    async def store(self, key, url, acodec):
+        """Скачивает поток в Opus-файл (перекодируя, только если это не Opus) и вытесняет лишнее."""
+        filename = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".opus"
+        path = os.path.join(self.directory, filename)
+        tmp = path + ".part"
+        codec = ["-c:a", "copy"] if acodec == "opus" else ["-c:a", "libopus", "-b:a", "96k"]
+
+        try:
+            async with self.slots:
+                process = await asyncio.create_subprocess_exec(
+                    FFMPEG_EXE, "-y", "-loglevel", "error", "-i", url, "-vn", *codec, "-f", "opus", tmp,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL
+                )
+                try:
+                    code = await asyncio.wait_for(process.wait(), timeout=AUDIO_CACHE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    code = -1
+
+            if code != 0:
+                logger.warning(f"⚠️ Не удалось сохранить трек в аудио-кэш (код ffmpeg {code})")
+                return
+
+            size = os.path.getsize(tmp)
+            entry = self.entries.get(key)
+            if entry is None or size > self.max_bytes:
+                return
+
+            os.replace(tmp, path)
+            entry["file"], entry["size"] = filename, size
+            self.total_bytes += size
+            logger.info(f"💽 Трек сохранён в аудио-кэш: {key} ({size // 1024} КБ)")
+            self.evict()
+            self.schedule_save()
+        finally:
+            self.pending.discard(key)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def evict(self):
+        for key, entry in self.entries.items():
+            if self.total_bytes <= self.max_bytes:
+                break
+            if not entry["file"]:
+                continue
+
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= entry["size"]
+            logger.info(f"🧹 Вытеснен из аудио-кэша: {key}")
+            entry["file"], entry["size"] = None, 0
+
+    def stats(self):
+        files = sum(1 for entry in self.entries.values() if entry["file"])
+        hits = sum(entry["hits"] for entry in self.entries.values())
+        return {"files": files, "bytes": self.total_bytes, "max_bytes": self.max_bytes, "hits": hits}
+
+
+class ExtractorPool:
+    """
+    Ограниченный пул потоков для yt_dlp.
+    Заявки раскладываются по очередям серверов и выдаются по кругу,
+    поэтому тяжёлый плейлист одного сервера не задерживает поиск на другом.
+    """
+
+    def __init__(self, workers=EXTRACT_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ytdl")
+        self.slots = asyncio.Semaphore(workers)
+        self.pending = OrderedDict()  # guild_id -> deque[(search, options, future)]
+        self.dispatcher = None
+
+    async def extract(self, guild_id, search, options=YTDL_OPTIONS, timeout=EXTRACT_TIMEOUT):
+        """
+        Ставит запрос в очередь сервера и ждёт результат не дольше timeout.
+        По таймауту или отмене заявка снимается с очереди; уже запущенный
+        поток доработает в фоне, но его результат будет отброшен.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.setdefault(guild_id, deque()).append((search, options, future))
+
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+
+        return await asyncio.wait_for(future, timeout=timeout)
+
+    def _next_job(self):
+        """Берёт следующую живую заявку, переходя по серверам по кругу."""
+        while self.pending:
+            guild_id, jobs = self.pending.popitem(last=False)
+            job = None
+            while jobs:
+                candidate = jobs.popleft()
+                if not candidate[2].done():
+                    job = candidate
+                    break
+            if jobs:
+                self.pending[guild_id] = jobs
+            if job:
+                return job
+        return None
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.slots.acquire()
+            job = self._next_job()
+            if job is None:
+                self.slots.release()
+                return
+
+            search, options, future = job
+            work = loop.run_in_executor(self.executor, _extract_info, search, options)
+            work.add_done_callback(functools.partial(self._finished, future))
+
+    def _finished(self, future, work):
+        # слот держим до реального завершения потока — иначе зависший yt_dlp
+        # не ограничивался бы размером пула
+        self.slots.release()
+        if future.done():
+            return
+        if work.cancelled():
+            future.cancel()
+        elif work.exception():
+            future.set_exception(work.exception())
+        else:
+            future.set_result(work.result())
+
+    def shutdown(self):
+        for jobs in self.pending.values():
+            for _, _, future in jobs:
+                future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def format_duration(duration):
+    try:
+        total = int(float(duration))
+        m, s = divmod(total, 60)
+        return f"{m}:{s:02}"
+    except Exception:
+        return "??:??"
+
+
+class Track:
+    """
+    Запись очереди. Хранит только данные для воспроизведения и embed
+    и ID того, кто заказал трек, — без interaction и других объектов discord.
+    """
+    __slots__ = (
+        'url', 'webpage_url', 'title', 'uploader', 'duration',
+        'acodec', 'thumbnail', 'requester_id', 'audio_path', 'requested_at'
+    )
+
+    def __init__(self, url, webpage_url=None, title='Неизвестная песня', uploader='Неизвестен',
+                 duration=0, acodec=None, thumbnail=None, requester_id=None):
+        self.url = url
+        self.webpage_url = webpage_url
+        self.title = title
+        self.uploader = uploader
+        self.duration = duration
+        self.acodec = acodec
+        self.thumbnail = thumbnail
+        self.requester_id = requester_id
+        self.audio_path = None
+        self.requested_at = None  # unix-время команды — для замера «до первого звука»
+
+    @classmethod
+    def from_flat_entry(cls, entry):
+        """Запись плейлиста без потока: url появится в Music.ensure_stream."""
+        return cls(
+            url=None,
+            webpage_url=entry.get('webpage_url') or entry.get('url'),
+            title=entry.get('title') or 'Загружается...',
+            uploader=entry.get('uploader') or 'Неизвестен',
+            duration=entry.get('duration') or 0,
+            thumbnail=entry.get('thumbnail'),
+        )
+
+    def fill_from(self, fresh):
+        """Дополняет трек данными свежего извлечения (для записей плейлиста — всеми сразу)."""
+        self.url = fresh.url
+        self.acodec = fresh.acodec
+        self.title = fresh.title
+        self.uploader = fresh.uploader
+        self.duration = fresh.duration or self.duration
+        self.thumbnail = fresh.thumbnail or self.thumbnail
+
+    @classmethod
+    def from_entry(cls, entry):
+        return cls(
+            url=entry.get('url'),
+            webpage_url=entry.get('webpage_url') or entry.get('original_url'),
+            title=entry.get('title', 'Неизвестная песня'),
+            uploader=entry.get('uploader', 'Неизвестен'),
+            duration=entry.get('duration') or 0,
+            acodec=entry.get('acodec'),
+            thumbnail=entry.get('thumbnail'),
+        )
+
+    def copy(self, requester_id=None):
+        """Копия для очереди: записи из кэша общие, а url и audio_path у трека в очереди меняются."""
+        return Track(self.url, self.webpage_url, self.title, self.uploader,
+                     self.duration, self.acodec, self.thumbnail, requester_id)
+
+    @property
+    def duration_str(self):
+        return format_duration(self.duration)
+
+
+class TimedSource(discord.AudioSource):
+    """
+    Обёртка над источником: сообщает в event loop момент, когда плеер discord.py
+    получил первый кадр, то есть звук реально пошёл в канал.
+    """
+
+    def __init__(self, source, loop, on_first_frame):
+        self.source = source
+        self.loop = loop
+        self.on_first_frame = on_first_frame
+
+    def read(self):
+        data = self.source.read()
+        if self.on_first_frame is not None and data:
+            callback, self.on_first_frame = self.on_first_frame, None
+            self.loop.call_soon_threadsafe(callback)
+        return data
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+
+class PlaylistProgress:
+    """Ход загрузки плейлиста — показывается в embed «Сейчас играет»."""
+    __slots__ = ('url', 'title', 'total', 'loaded', 'done')
+
+    def __init__(self, url, title, total=None):
+        self.url = url
+        self.title = title or "Плейлист"
+        self.total = total
+        self.loaded = 0
+        self.done = False
+
+    def add_chunk(self, count):
+        self.loaded += count
+        if count < PLAYLIST_CHUNK or (self.total and self.loaded >= self.total):
+            self.done = True
+
+    def describe(self):
+        text = f"«{self.title}»: загружено {self.loaded}"
+        if self.total:
+            text += f" из {self.total}"
+        return text + (" ✅" if self.done else " ⏳")
+
+
+class PlayerState:
+    """
+    Состояния плеера сервера. Переходы делают только методы Music:
+    IDLE -> PLAYING (start_next), PLAYING <-> PAUSED (toggle_pause),
+    PLAYING/PAUSED -> IDLE (on_track_end, skip_track), любое -> STOPPED (stop_player, close).
+    """
+    IDLE = "idle"          # ничего не играет — можно запускать следующий трек
+    PLAYING = "playing"
+    PAUSED = "paused"
+    STOPPED = "stopped"    # плеер закрыт, события от старых треков игнорируются
+
+
+class GuildPlayer:
+    """
+    Единственный владелец состояния музыки на сервере.
+    queue[0] — текущий трек; очередь меняется только методами ниже.
+    Переходы плеера (смена queue[0]) идут под lock; remove/move/shuffle
+    синхронны и queue[0] не трогают, поэтому lock им не нужен.
+    """
+    __slots__ = (
+        'guild_id', 'vc', 'text_channel_id', 'queue', 'repeat', 'msg', 'state',
+        'play_id', 'lock', 'prefetch_task', 'prefetched', 'started_at',
+        'playlist', 'ingest_task', 'view', 'embed_task', 'embed_dirty', 'last_payload',
+        'ended_at'
+    )
+
+    def __init__(self, guild_id, vc, text_channel_id):
+        self.guild_id = guild_id
+        self.vc = vc
+        self.text_channel_id = text_channel_id
+        self.queue = deque()
+        self.repeat = False
+        self.msg = None
+        self.state = PlayerState.IDLE
+        self.play_id = 0
+        self.lock = asyncio.Lock()
+        self.prefetch_task = None
+        self.prefetched = None   # (track, url, source) — подогретый ffmpeg для следующего трека
+        self.started_at = None
+        self.playlist = None     # PlaylistProgress последнего добавленного плейлиста
+        self.ingest_task = None
+        self.view = None         # один ControlView на всё время жизни сообщения
+        self.embed_task = None
+        self.embed_dirty = False
+        self.last_payload = None # то, что сейчас показано в msg — одинаковые правки не отправляем
+        self.ended_at = None     # perf_counter конца предыдущего трека — для замера паузы между треками
+
+    @property
+    def current(self):
+        return self.queue[0] if self.queue else None
+
+    def upcoming(self, count):
+        """Треки после текущего, не больше count."""
+        return list(islice(self.queue, 1, 1 + count))
+
+    def next_track(self):
+        """Трек, который заиграет после текущего (при повторе — тот же самый)."""
+        index = 0 if self.repeat else 1
+        return self.queue[index] if len(self.queue) > index else None
+
+    def add(self, tracks):
+        self.queue.extend(tracks)
+
+    def advance(self):
+        """Убирает текущий трек — O(1)."""
+        if self.queue:
+            self.queue.popleft()
+
+    def remove(self, index):
+        """Убирает трек по номеру в очереди (0 — текущий) и возвращает его."""
+        track = self.queue[index]
+        del self.queue[index]
+        return track
+
+    def move(self, src, dst):
+        track = self.queue[src]
+        del self.queue[src]
+        self.queue.insert(dst, track)
+        return track
+
+    def shuffle(self):
+        """Перемешивает очередь, не трогая текущий трек."""
+        if len(self.queue) < 3:
+            return
+        current = self.queue.popleft()
+        rest = list(self.queue)
+        random.shuffle(rest)
+        self.queue = deque(rest)
+        self.queue.appendleft(current)
+
+    def clear(self):
+        self.queue.clear()
+
 
 class ControlView(discord.ui.View):
     def __init__(self, music_cog, guild_id):
@@ -25,99 +625,62 @@ class ControlView(discord.ui.View):
         self.music_cog = music_cog
         self.guild_id = guild_id
 
+    def sync(self, player):
+        """Приводит кнопки паузы и повтора к состоянию плеера — view переиспользуется между треками."""
+        paused = player.state == PlayerState.PAUSED
+        self.pause_resume.emoji = "▶️" if paused else "⏸️"
+        self.pause_resume.style = discord.ButtonStyle.gray if paused else discord.ButtonStyle.green
+        self.repeat.style = discord.ButtonStyle.green if player.repeat else discord.ButtonStyle.gray
+
     @discord.ui.button(emoji="⏸️", style=discord.ButtonStyle.green)
     async def pause_resume(self, interaction, button):
-        queue_data = self.music_cog.guild_queues.get(self.guild_id)
-        if not queue_data or not queue_data.get('vc'):
-            await interaction.response.defer()
-            return
-
-        vc = queue_data['vc']
+        state = await self.music_cog.toggle_pause(self.guild_id)
 
-        if vc.is_playing():
-            vc.pause()
+        if state == PlayerState.PAUSED:
             button.emoji = "▶️"
             button.style = discord.ButtonStyle.gray
-        elif vc.is_paused():
-            vc.resume()
+        elif state == PlayerState.PLAYING:
             button.emoji = "⏸️"
             button.style = discord.ButtonStyle.green
+        else:
+            await interaction.response.defer()
+            return
 
         await interaction.response.edit_message(view=self)
 
     @discord.ui.button(emoji="⏭️", style=discord.ButtonStyle.blurple)
     async def skip(self, interaction, button):
-        queue_data = self.music_cog.guild_queues.get(self.guild_id)
-        if not queue_data:
-            await interaction.response.defer()
-            return
-
-        # Помечаем skip и удаляем текущий трек немедленно.
-        # Это гарантирует, что repeat не вернёт трек обратно.
-        queue_data['skip_requested'] = True
-        if queue_data.get('queue'):
-            try:
-                queue_data['queue'].pop(0)
-            except Exception:
-                pass
-
-        vc = queue_data.get('vc')
-        if vc and (vc.is_playing() or vc.is_paused()):
-            vc.stop()
-
         await interaction.response.defer()
+        await self.music_cog.skip_track(self.guild_id)
 
     @discord.ui.button(emoji="⏹️", style=discord.ButtonStyle.red)
     async def stop(self, interaction, button):
-        queue_data = self.music_cog.guild_queues.get(self.guild_id)
-        if queue_data:
-            queue_data['queue'].clear()
-            queue_data['skip_requested'] = False
-            queue_data['after_running'] = False
-            # сигналим after_event чтобы player_loop не висел
-            ae = queue_data.get('after_event')
-            if ae:
-                try:
-                    ae.set()
-                except Exception:
-                    pass
-
-            if queue_data.get('vc'):
-                try:
-                    await queue_data['vc'].disconnect()
-                except Exception:
-                    pass
-
-            if queue_data.get('msg'):
-                try:
-                    await queue_data['msg'].edit(embed=discord.Embed(title="🎵 Очередь очищена"), view=None)
-                except Exception:
-                    pass
-
-            self.music_cog.guild_queues.pop(self.guild_id, None)
-
         await interaction.response.defer()
+        await self.music_cog.stop_player(self.guild_id)
 
     @discord.ui.button(emoji="🔁", style=discord.ButtonStyle.gray)
     async def repeat(self, interaction, button):
-        queue_data = self.music_cog.guild_queues.get(self.guild_id)
-        if queue_data:
-            queue_data['repeat'] = not queue_data.get('repeat', False)
+        repeat = self.music_cog.toggle_repeat(self.guild_id)
+        if repeat is None:
+            await interaction.response.defer()
+            return
 
-            if queue_data['repeat']:
-                button.style = discord.ButtonStyle.green
-            else:
-                button.style = discord.ButtonStyle.gray
+        button.style = discord.ButtonStyle.green if repeat else discord.ButtonStyle.gray
 
-            # Перерисуем сообщение чтобы кнопка визуально обновилась
+        # Перерисуем сообщение чтобы кнопка визуально обновилась
+        try:
+            await interaction.response.edit_message(view=self)
+        except Exception:
+            # fallback — просто ответим и позволим schedule_embed_update обновить view позже
             try:
-                await interaction.response.edit_message(view=self)
+                await interaction.response.send_message("🔁 Toggle repeat", ephemeral=True)
             except Exception:
-                # fallback — просто ответим и позволим update_queue_embed обновить view позже
-                try:
-                    await interaction.response.send_message("🔁 Toggle repeat", ephemeral=True)
-                except Exception:
-                    pass
+                pass
+
+    @discord.ui.button(emoji="🔀", style=discord.ButtonStyle.gray)
+    async def shuffle(self, interaction, button):
+        await interaction.response.defer()
+        await self.music_cog.shuffle_queue(self.guild_id)
 
 
 class TrackSelect(discord.ui.Select):
@@ -127,8 +690,8 @@ class TrackSelect(discord.ui.Select):
 
         options = [
             discord.SelectOption(
-                label=track['title'][:100],
-                description=f"{track.get('uploader', 'Неизвестен')} | {track.get('duration_str', '??:??')}"[:100],
+                label=track.title[:100],
+                description=f"{track.uploader} | {track.duration_str}"[:100],
                 value=str(idx)
             )
             for idx, track in enumerate(tracks[:25])
@@ -145,13 +708,15 @@ class TrackSelect(discord.ui.Select):
 
     async def callback(self, interaction):
         idx = int(self.values[0])
-        track = self.tracks[idx]
+        track = self.tracks[idx].copy(requester_id=interaction.user.id)
+        track.requested_at = interaction.created_at.timestamp()
 
-        queue_data = self.music_cog.guild_queues.get(self.guild_id)
-        queue_data['queue'].append(track)
+        if not self.music_cog.enqueue(self.guild_id, [track]):
+            await interaction.response.send_message("❌ Плеер уже остановлен, запустите /музыка заново.", ephemeral=True)
+            return
 
         await interaction.response.send_message(
-            f"✅ Трек **{track['title']}** добавлен в очередь!",
+            f"✅ Трек **{track.title}** добавлен в очередь!",
             ephemeral=True
         )
 
@@ -162,9 +727,6 @@ class TrackSelect(discord.ui.Select):
         except Exception:
             pass
 
-        if len(queue_data['queue']) == 1:
-            asyncio.create_task(self.music_cog.player_loop(self.guild_id))
-
 
 class TrackSelectView(discord.ui.View):
     def __init__(self, music_cog, guild_id, tracks):
@@ -175,8 +737,24 @@ class TrackSelectView(discord.ui.View):
 class Music(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.guild_queues = {}
-        self.guild_locks = {}
+        self.players = {}  # guild_id -> GuildPlayer
+        self.extractor = ExtractorPool()
+        # "запрос" -> список треков; ссылка на страницу трека -> трек.
+        # В кэше лежат общие записи Track — в очередь попадают их копии (Track.copy).
+        self.search_cache = TTLCache()
+        self.track_cache = TTLCache()
+        self.disk_cache = AudioDiskCache()
+        # задержки по серверам: extract — yt_dlp, prepare — от решения играть до vc.play,
+        # first_audio — от команды до первого кадра, gap — тишина между треками
+        self.metrics = LatencyRegistry()
+
+    def cog_unload(self):
+        self.extractor.shutdown()
+
+    def interaction_time_left(self, interaction):
+        """Сколько секунд ещё можно отвечать на interaction."""
+        age = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        return INTERACTION_TTL - age
 
     async def ensure_voice(self, interaction):
         if interaction.user.voice and interaction.user.voice.channel:
@@ -185,196 +763,533 @@ class Music(commands.Cog):
         await interaction.response.send_message("❌ Вы не находитесь в голосовом канале.", ephemeral=True)
         return None
 
-    def format_duration(self, duration):
-        try:
-            total = int(float(duration))
-            m, s = divmod(total, 60)
-            return f"{m}:{s:02}"
-        except Exception:
-            return "??:??"
+    def cache_key(self, запрос):
+        if запрос.startswith("http"):
+            return normalize_url(запрос)
+        return normalize_query(запрос)
 
-    async def update_queue_embed(self, guild_id):
-        queue_data = self.guild_queues.get(guild_id)
-        if not queue_data or not queue_data.get('queue') or not queue_data.get('msg'):
-            return
+    def cache_tracks(self, запрос, tracks):
+        """Кладёт результат поиска и каждый трек в кэш со сроком жизни их ссылок."""
+        for track in tracks:
+            if track.webpage_url:
+                self.track_cache.set(normalize_url(track.webpage_url), track, stream_ttl(track.url))
 
-        current = queue_data['queue'][0]
-        embed = discord.Embed(title=f"🎶 Сейчас играет: {current['title']}", color=discord.Color.orange())
-        embed.add_field(name="Источник:", value="SoundCloud", inline=True)
-        embed.add_field(name="Автор:", value=current.get('uploader', 'Неизвестен'), inline=True)
-        embed.add_field(name="Длительность:", value=current.get('duration_str', '??:??'), inline=True)
+        ttl = min((stream_ttl(t.url) for t in tracks), default=0)
+        self.search_cache.set(self.cache_key(запрос), tracks, ttl)
 
-        if current.get('thumbnail'):
-            embed.set_thumbnail(url=current['thumbnail'])
+    async def fetch_playlist_chunk(self, guild_id, url, start, timeout=EXTRACT_TIMEOUT):
+        """Плоское извлечение записей плейлиста с номера start (одиночный трек придёт целиком)."""
+        options = dict(YTDL_FLAT_OPTIONS, playlist_items=f"{start}-{start + PLAYLIST_CHUNK - 1}")
+        with self.metrics.span(guild_id, "extract"):
+            return await self.extractor.extract(guild_id, url, options=options, timeout=timeout)
 
-        next_tracks = queue_data['queue'][1:6]
-        if next_tracks:
-            value = "\n".join(f"{idx}. {t['title']} ({t.get('duration_str','??:??')})"
-                              for idx, t in enumerate(next_tracks, start=1))
-            embed.add_field(name=f"Следующие {len(next_tracks)} трек(а):", value=value, inline=False)
+    async def resolve(self, guild_id, запрос, timeout=EXTRACT_TIMEOUT):
+        """
+        Возвращает (треки, плейлист) по запросу: из кэша или через пул yt_dlp.
+        Для ссылки на плейлист приходит только первая порция записей без потоков
+        и PlaylistProgress, по которому ingest_playlist догрузит остальное.
+        """
+        if запрос.startswith("http"):
+            track = self.track_cache.get(normalize_url(запрос))
+            if track:
+                return [track], None
+
+        tracks = self.search_cache.get(self.cache_key(запрос))
+        if tracks is not None:
+            logger.debug(f"🎯 Кэш поиска: '{запрос}' ({len(tracks)} тр.)")
+            return tracks, None
+
+        if запрос.startswith("http"):
+            info = await self.fetch_playlist_chunk(guild_id, запрос, 1, timeout)
+            if info.get('_type') == 'playlist':
+                entries = [entry for entry in info.get('entries') or [] if entry]
+                playlist = PlaylistProgress(запрос, info.get('title'), info.get('playlist_count'))
+                playlist.add_chunk(len(entries))
+                return [Track.from_flat_entry(entry) for entry in entries], playlist
         else:
-            embed.add_field(name="Следующие треки:", value="🎵 Очередь пуста", inline=False)
+            with self.metrics.span(guild_id, "extract"):
+                info = await self.extractor.extract(guild_id, f"scsearch:{запрос}", timeout=timeout)
+
+        entries = info['entries'] if 'entries' in info else [info]
+        tracks = [Track.from_entry(entry) for entry in entries if entry]
+        if tracks:
+            self.cache_tracks(запрос, tracks)
+        return tracks, None
+
+    async def ingest_playlist(self, player, playlist, requester_id):
+        """Фоном догружает плейлист порциями и сразу ставит их в очередь."""
+        while not playlist.done and player.state != PlayerState.STOPPED:
+            try:
+                info = await self.fetch_playlist_chunk(player.guild_id, playlist.url, playlist.loaded + 1)
+            except Exception as e:
+                logger.warning(f"⚠️ Плейлист {playlist.url} загружен не полностью: {e}")
+                break
+
+            entries = [entry for entry in info.get('entries') or [] if entry]
+            playlist.add_chunk(len(entries))
+            tracks = [Track.from_flat_entry(entry).copy(requester_id=requester_id) for entry in entries]
+            if tracks and not self.enqueue(player.guild_id, tracks):
+                break
+
+        playlist.done = True
+        logger.info(f"📃 Плейлист {playlist.url}: {playlist.loaded} тр. (сервер {player.guild_id})")
+        self.schedule_embed_update(player.guild_id)
+
+    # ------------------- Предзагрузка -------------------
+    async def make_source(self, track):
+        """
+        Создаёт источник для трека и записывает в track.audio_path, каким путём он пойдёт.
+        Opus-поток ffmpeg только перепаковывает (codec copy), остальное сам перекодирует в Opus.
+        Кодек берём из данных yt_dlp, а если его там нет — спрашиваем ffprobe.
+        ffmpeg запускается прямо в конструкторе и сразу начинает подключаться к потоку.
+        """
+        path = self.disk_cache.path_for(track)
+        if path:
+            track.audio_path = 'opus-disk'
+            return discord.FFmpegOpusAudio(path, codec='copy', executable=FFMPEG_EXE)
+
+        url = track.url
+        if not OPUS_PASSTHROUGH:
+            track.audio_path = 'pcm'
+            return discord.FFmpegPCMAudio(url, executable=FFMPEG_EXE, **FFMPEG_OPTIONS)
+
+        codec = (track.acodec or '').lower()
+        bitrate = None
+        if codec in ('', 'none'):
+            try:
+                codec, bitrate = await discord.FFmpegOpusAudio.probe(url, method='fallback', executable=FFMPEG_EXE)
+            except Exception as e:
+                logger.debug(f"ffprobe не смог определить кодек '{track.title}': {e}")
+                codec = None
+
+        passthrough = codec == 'opus'
+        track.audio_path = 'opus-copy' if passthrough else 'opus-transcode'
+        logger.debug(f"🎧 '{track.title}': {track.audio_path} (кодек {codec or '?'})")
+
+        return discord.FFmpegOpusAudio(
+            url,
+            codec='copy' if passthrough else None,
+            bitrate=bitrate,
+            executable=FFMPEG_EXE,
+            **FFMPEG_OPTIONS
+        )
+
+    async def ensure_stream(self, guild_id, track):
+        """Проверяет, что ссылка на поток ещё действует, и при необходимости получает новую."""
+        if stream_ttl(track.url) > 0 or self.disk_cache.path_for(track):
+            return True
+        if not track.webpage_url:
+            return False
 
         try:
-            await queue_data['msg'].edit(embed=embed, view=ControlView(self, guild_id))
-        except Exception:
-            pass
+            fresh, _ = await self.resolve(guild_id, track.webpage_url)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось обновить ссылку на '{track.title}': {e}")
+            return False
+
+        if not fresh or not fresh[0].url:
+            return False
+        track.fill_from(fresh[0])
+        return True
 
-    async def after_song_and_next(self, guild_id):
+    def schedule_prefetch(self, guild_id):
+        player = self.players.get(guild_id)
+        if not player or not player.queue:
+            return
+
+        if player.prefetch_task and not player.prefetch_task.done():
+            player.prefetch_task.cancel()
+        player.prefetch_task = asyncio.create_task(self.prefetch(player, player.current))
+
+    async def prefetch(self, player, current):
         """
-        Обработка окончания трека. Защищаемся от параллельных вызовов.
-        В конце — ставим after_event, чтобы player_loop продолжил цикл.
+        Фоновая стадия: обновляет ссылки для ближайших треков, а ближе к концу
+        текущего заранее запускает ffmpeg для следующего, чтобы смена трека шла без паузы.
         """
-        queue_data = self.guild_queues.get(guild_id)
-        if not queue_data:
+        for track in player.upcoming(PREFETCH_AHEAD):
+            await self.ensure_stream(player.guild_id, track)
+
+        started_at = player.started_at or time.monotonic()
+        delay = started_at + float(current.duration or 0) - PREFETCH_WARM_LEAD - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if player.current is not current:
             return
 
-        # защита от параллельных вызовов
-        if queue_data.get('after_running', False):
-            # если уже выполняется — просто set event, чтобы player_loop не ждём вечно
-            ae = queue_data.get('after_event')
-            if ae:
-                try:
-                    ae.set()
-                except Exception:
-                    pass
+        upcoming = player.next_track()
+        if not upcoming:
+            return
+
+        if player.prefetched and player.prefetched[0] is upcoming and player.prefetched[1] == upcoming.url:
+            return
+
+        self.drop_prefetched_source(player)
+        if not await self.ensure_stream(player.guild_id, upcoming):
             return
 
-        queue_data['after_running'] = True
         try:
-            async with self.guild_locks[guild_id]:
-                # если skip был — при нажатии skip трек уже удалили, просто сбрасываем флаг
-                if queue_data.get('skip_requested', False):
-                    queue_data['skip_requested'] = False
-                else:
-                    # обычное завершение — удаляем трек только если repeat выключен
-                    if queue_data.get('queue') and not queue_data.get('repeat', False):
-                        try:
-                            queue_data['queue'].pop(0)
-                        except Exception:
-                            pass
-
-            # обновляем embed / view
-            if queue_data.get('msg') and queue_data.get('queue'):
-                await self.update_queue_embed(guild_id)
-            elif queue_data.get('msg'):
-                try:
-                    await queue_data['msg'].edit(embed=discord.Embed(title="🎵 Очередь пуста"), view=None)
-                except Exception:
-                    pass
-        finally:
-            # сигналим player_loop что обработка завершена
-            ae = queue_data.get('after_event')
-            if ae:
-                try:
-                    ae.set()
-                except Exception:
-                    pass
-            queue_data['after_running'] = False
+            source = await self.make_source(upcoming)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось подготовить '{upcoming.title}': {e}")
+            return
+
+        player.prefetched = (upcoming, upcoming.url, source)
+        logger.debug(f"🔥 Подготовлен следующий трек '{upcoming.title}' (сервер {player.guild_id})")
+
+    def take_prefetched(self, player, track):
+        """Отдаёт подготовленный источник, если он для этого трека и ffmpeg ещё жив."""
+        prefetched = player.prefetched
+        player.prefetched = None
+        if not prefetched:
+            return None
+
+        prepared_for, url, source = prefetched
+        process = getattr(source, '_process', None)
+        alive = process is None or process.poll() is None
+        if prepared_for is track and url == track.url and alive:
+            return source
+
+        source.cleanup()
+        return None
+
+    def drop_prefetched_source(self, player):
+        prefetched = player.prefetched
+        player.prefetched = None
+        if prefetched:
+            try:
+                prefetched[2].cleanup()
+            except Exception:
+                pass
+
+    def drop_prefetch(self, player):
+        """Останавливает предзагрузку и закрывает подготовленный ffmpeg."""
+        if player.prefetch_task and not player.prefetch_task.done():
+            player.prefetch_task.cancel()
+        player.prefetch_task = None
+        self.drop_prefetched_source(player)
+
+    def discard_stale_prefetch(self, player):
+        """
+        Вызывается после изменения очереди: выбрасывает источник, если его трек
+        уже не текущий (skip сдвигает очередь до start_next) и не следующий.
+        """
+        if player.prefetched and player.prefetched[0] not in (player.current, player.next_track()):
+            self.drop_prefetched_source(player)
+
+    def render_embed(self, player):
+        current = player.current
+        if current is None:
+            return None
+
+        embed = discord.Embed(title=f"🎶 Сейчас играет: {current.title}", color=discord.Color.orange())
+        embed.add_field(name="Источник:", value="SoundCloud", inline=True)
+        embed.add_field(name="Автор:", value=current.uploader, inline=True)
+        embed.add_field(name="Длительность:", value=current.duration_str, inline=True)
+        if current.audio_path:
+            embed.add_field(name="Поток:", value=AUDIO_PATHS[current.audio_path], inline=True)
+
+        if current.thumbnail:
+            embed.set_thumbnail(url=current.thumbnail)
+
+        next_tracks = player.upcoming(5)
+        if next_tracks:
+            value = "\n".join(f"{idx}. {t.title} ({t.duration_str})"
+                              for idx, t in enumerate(next_tracks, start=1))
+            embed.add_field(name=f"Следующие {len(next_tracks)} трек(а):", value=value, inline=False)
+        else:
+            embed.add_field(name="Следующие треки:", value="🎵 Очередь пуста", inline=False)
+
+        if player.playlist:
+            embed.add_field(name="📃 Плейлист:", value=player.playlist.describe(), inline=False)
+
+        return embed
 
-    async def player_loop(self, guild_id):
+    def schedule_embed_update(self, guild_id):
         """
-        Цикл воспроизведения. После окончания воспроизведения ждём завершения after_song_and_next
-        через asyncio.Event (after_event) — это устраняет гонки и делает repeat стабильным.
+        Просит перерисовать «Сейчас играет». Запросы в пределах EMBED_DEBOUNCE
+        сливаются в одну правку, а если картинка не изменилась — правки нет вовсе.
         """
-        queue_data = self.guild_queues.get(guild_id)
-        if not queue_data:
+        player = self.players.get(guild_id)
+        if not player or not player.msg:
             return
 
-        vc = queue_data['vc']
-        lock = self.guild_locks.setdefault(guild_id, asyncio.Lock())
+        player.embed_dirty = True
+        if player.embed_task is None or player.embed_task.done():
+            player.embed_task = asyncio.create_task(self.flush_embed(player))
+
+    async def flush_embed(self, player):
+        # запросы, пришедшие во время msg.edit, снова поднимают embed_dirty — цикл их подхватит
+        while player.embed_dirty:
+            await asyncio.sleep(EMBED_DEBOUNCE)
+            player.embed_dirty = False
+            if player.state == PlayerState.STOPPED:
+                return
+
+            embed = self.render_embed(player)
+            if embed is None:
+                return
+
+            player.view.sync(player)
+            payload = (embed.to_dict(), player.view.to_components())
+            if payload == player.last_payload:
+                continue
 
-        while queue_data.get('queue'):
-            # защитная проверка
-            if not queue_data.get('queue'):
-                break
+            try:
+                await player.msg.edit(embed=embed, view=player.view)
+                player.last_payload = payload
+            except Exception:
+                pass
 
+    # ------------------- Плеер: переходы состояний -------------------
+    def after_callback(self, guild_id, play_id):
+        """
+        after для vc.play. Вызывается из потока плеера discord.py — переносим событие в event loop.
+        play_id отличает конец этого запуска от запусков, которые уже сменили skip/stop.
+        """
+        def after_play(error):
+            ended_at = time.perf_counter()
             try:
-                current = queue_data['queue'][0]
+                asyncio.run_coroutine_threadsafe(self.on_track_end(guild_id, play_id, error, ended_at), self.bot.loop)
             except Exception:
-                break
+                pass
+
+        return after_play
+
+    def first_frame_callback(self, player, track, play_id):
+        """Замеры в момент первого кадра: время до первого звука и пауза после прошлого трека."""
+        def on_first_frame():
+            if player.play_id != play_id:
+                return
+
+            parts = []
+            if track.requested_at:
+                first_audio = time.time() - track.requested_at
+                track.requested_at = None
+                self.metrics.observe(player.guild_id, "first_audio", first_audio)
+                parts.append(f"первый звук через {first_audio:.2f} с")
+            if player.ended_at is not None:
+                gap = time.perf_counter() - player.ended_at
+                player.ended_at = None
+                self.metrics.observe(player.guild_id, "gap", gap)
+                parts.append(f"пауза между треками {gap:.2f} с")
+
+            if parts:
+                logger.info(f"⏱ Сервер {player.guild_id}, '{track.title}': " + ", ".join(parts))
+
+        return on_first_frame
+
+    def enqueue(self, guild_id, tracks):
+        """Добавляет треки в очередь и запускает плеер, если он простаивает."""
+        player = self.players.get(guild_id)
+        if not player or player.state == PlayerState.STOPPED:
+            return False
+
+        # «до первого звука» честно мерить только у трека, который заиграет сразу
+        if player.state != PlayerState.IDLE or player.queue:
+            for track in tracks:
+                track.requested_at = None
+
+        player.add(tracks)
+
+        if player.state == PlayerState.IDLE:
+            asyncio.create_task(self.start_next(guild_id))
+        else:
+            self.schedule_prefetch(guild_id)
+            self.schedule_embed_update(guild_id)
+        return True
+
+    async def start_next(self, guild_id):
+        """IDLE -> PLAYING: запускает queue[0]; если играть нечего — закрывает плеер."""
+        player = self.players.get(guild_id)
+        if not player:
+            return
 
-            url = current.get('url')
-            if not url:
-                async with lock:
+        current = None
+        started = time.perf_counter()
+        while current is None:
+            async with player.lock:
+                if player.state != PlayerState.IDLE:
+                    return
+                if not player.queue:
+                    break
+                candidate = player.current
+                play_id = player.play_id
+
+            # ссылку обновляем без lock: yt-dlp может думать до EXTRACT_TIMEOUT,
+            # а stop/skip/пауза в это время должны откликаться
+            ready = await self.ensure_stream(guild_id, candidate)
+
+            async with player.lock:
+                # пока ждали, плеер могли остановить, запустить или сменить первый трек
+                if player.state != PlayerState.IDLE:
+                    return
+                if player.play_id != play_id or player.current is not candidate:
+                    continue
+
+                if ready:
+                    source = None
+                    player.play_id += 1
                     try:
-                        queue_data['queue'].pop(0)
-                    except Exception:
-                        pass
-                continue
+                        # берём подогретый источник, если предзагрузка успела, иначе создаём прямо перед play
+                        source = self.take_prefetched(player, candidate) or await self.make_source(candidate)
+                        timed = TimedSource(source, self.bot.loop,
+                                            self.first_frame_callback(player, candidate, player.play_id))
+                        player.vc.play(timed, after=self.after_callback(guild_id, player.play_id))
+                        current = candidate
+                    except Exception as e:
+                        logger.warning(f"⚠️ Не удалось запустить '{candidate.title}': {e}")
+                        if source:
+                            source.cleanup()
+
+                if current is None:
+                    # трек не играется — убираем и пробуем следующий
+                    player.advance()
+                    continue
+
+                self.metrics.observe(guild_id, "prepare", time.perf_counter() - started)
+                logger.info(f"▶️ '{current.title}' (сервер {guild_id}): {current.audio_path}")
+                self.disk_cache.record_play(current, from_disk=current.audio_path == 'opus-disk')
+                player.state = PlayerState.PLAYING
+                player.started_at = time.monotonic()
+
+        if current is None:
+            await self.close(guild_id, "🎵 Очередь пуста")
+            return
 
-            # подготовим after_event для синхронизации
-            queue_data['after_event'] = asyncio.Event()
-            # source создаём прямо перед play
-            source = discord.FFmpegPCMAudio(
-                url,
-                executable=FFMPEG_EXE,
-                **FFMPEG_OPTIONS
-            )
+        self.schedule_prefetch(guild_id)
 
-            def after_play(error):
-                # запускаем обработку окончания в event loop
+        # создаём сообщение статуса сразу с готовым embed, дальше его только правим
+        if player.msg is None:
+            channel = self.bot.get_channel(player.text_channel_id)
+            if channel:
+                player.view = ControlView(self, guild_id)
+                player.view.sync(player)
+                embed = self.render_embed(player)
                 try:
-                    asyncio.run_coroutine_threadsafe(self.after_song_and_next(guild_id), self.bot.loop)
+                    player.msg = await channel.send(embed=embed, view=player.view)
+                    player.last_payload = (embed.to_dict(), player.view.to_components())
                 except Exception:
                     pass
+        else:
+            self.schedule_embed_update(guild_id)
 
-            try:
-                vc.play(source, after=after_play)
-            except Exception:
-                # если play упал — убираем трек и продолжаем
-                async with lock:
-                    try:
-                        queue_data['queue'].pop(0)
-                    except Exception:
-                        pass
-                await asyncio.sleep(0.5)
-                continue
+    async def on_track_end(self, guild_id, play_id, error=None, ended_at=None):
+        """PLAYING -> IDLE по событию after: при повторе трек остаётся первым, иначе уходит из очереди."""
+        player = self.players.get(guild_id)
+        if not player or player.play_id != play_id:
+            return
 
-            # создаём/обновляем сообщение статуса если нужно
-            if queue_data.get('msg') is None:
-                try:
-                    msg = await current['interaction'].followup.send(embed=discord.Embed(title="🎶 Загружается..."),
-                                                                    view=ControlView(self, guild_id))
-                    queue_data['msg'] = msg
-                except Exception:
-                    pass
+        if error:
+            logger.warning(f"⚠️ Ошибка воспроизведения (сервер {guild_id}): {error}")
 
-            await self.update_queue_embed(guild_id)
+        async with player.lock:
+            if player.play_id != play_id or player.state not in (PlayerState.PLAYING, PlayerState.PAUSED):
+                return
 
-            # ждём пока ffmpeg не завершит проигрывание (или пока не будет паузы/стоп)
-            while vc.is_playing() or vc.is_paused():
-                await asyncio.sleep(1)
+            if not player.repeat:
+                player.advance()
+            player.state = PlayerState.IDLE
+            player.ended_at = ended_at
 
-            # ждем, пока after_song_and_next сделает свою работу (упадёт флаг after_event)
-            ae = queue_data.get('after_event')
-            if ae:
-                try:
-                    # ждём до небольшого таймаута — на случай проблем
-                    await asyncio.wait_for(ae.wait(), timeout=5.0)
-                except asyncio.TimeoutError:
-                    # если after_song завис — продолжим, но это не должно обычно случаться
-                    pass
-                finally:
-                    # очищаем поле, чтобы в следующей итерации повесить новый Event
-                    queue_data['after_event'] = None
+        await self.start_next(guild_id)
 
-            # цикл повторится и возьмёт уже актуальный первый элемент очереди
+    async def skip_track(self, guild_id):
+        """PLAYING/PAUSED -> IDLE: текущий трек уходит из очереди даже при повторе."""
+        player = self.players.get(guild_id)
+        if not player:
+            return
 
-        # очистка после окончания очереди
-        try:
-            if vc.is_connected():
-                await vc.disconnect()
-        except Exception:
-            pass
+        async with player.lock:
+            if player.state not in (PlayerState.PLAYING, PlayerState.PAUSED):
+                return
+
+            # новый play_id — after от остановленного трека будет проигнорирован
+            player.play_id += 1
+            player.advance()
+            player.ended_at = time.perf_counter()
+            self.discard_stale_prefetch(player)
+            player.state = PlayerState.IDLE
+            player.vc.stop()
+
+        await self.start_next(guild_id)
+
+    async def toggle_pause(self, guild_id):
+        """PLAYING <-> PAUSED. Возвращает новое состояние или None, если плеера нет."""
+        player = self.players.get(guild_id)
+        if not player:
+            return None
+
+        async with player.lock:
+            if player.state == PlayerState.PLAYING:
+                player.vc.pause()
+                player.state = PlayerState.PAUSED
+            elif player.state == PlayerState.PAUSED:
+                player.vc.resume()
+                player.state = PlayerState.PLAYING
+            return player.state
+
+    def toggle_repeat(self, guild_id):
+        """Переключает режим повтора; он решает, какой переход сделает on_track_end."""
+        player = self.players.get(guild_id)
+        if not player:
+            return None
+
+        player.repeat = not player.repeat
+        # следующий трек поменялся — готовим другой источник
+        self.schedule_prefetch(guild_id)
+        return player.repeat
+
+    async def shuffle_queue(self, guild_id):
+        player = self.players.get(guild_id)
+        if not player:
+            return
+
+        player.shuffle()
+        self.discard_stale_prefetch(player)
+        self.schedule_prefetch(guild_id)
+        self.schedule_embed_update(guild_id)
+
+    async def stop_player(self, guild_id):
+        """Любое состояние -> STOPPED: очистка очереди и выход из канала."""
+        player = self.players.get(guild_id)
+        if not player:
+            return
+
+        async with player.lock:
+            player.state = PlayerState.STOPPED
+            player.play_id += 1
+            player.clear()
+            player.vc.stop()
+
+        await self.close(guild_id, "🎵 Очередь очищена")
+
+    async def close(self, guild_id, title):
+        """Финальный переход: гасим предзагрузку, выходим из канала и забываем сервер."""
+        player = self.players.get(guild_id)
+        if not player:
+            return
+
+        player.state = PlayerState.STOPPED
+        self.drop_prefetch(player)
+        for task in (player.ingest_task, player.embed_task):
+            if task and not task.done():
+                task.cancel()
 
-        # удаляем гильдийные данные
         try:
-            self.guild_queues.pop(guild_id, None)
-            self.guild_locks.pop(guild_id, None)
+            if player.vc.is_connected():
+                await player.vc.disconnect()
         except Exception:
             pass
 
+        if player.msg:
+            try:
+                await player.msg.edit(embed=discord.Embed(title=title), view=None)
+            except Exception:
+                pass
+
+        self.players.pop(guild_id, None)
+
     @app_commands.command(name="музыка", description="Играет песню или плейлист (только SoundCloud)")
     @app_commands.describe(запрос="Название песни или ссылка на SoundCloud")
     async def play(self, interaction, запрос: str):
@@ -385,42 +1300,29 @@ class Music(commands.Cog):
         await interaction.response.defer(thinking=True)
 
         guild_id = interaction.guild.id
-        queue_data = self.guild_queues.get(guild_id)
+        player = self.players.get(guild_id)
 
-        if not queue_data:
+        if not player:
             vc = await channel.connect()
-            self.guild_queues[guild_id] = {
-                'queue': [],
-                'vc': vc,
-                'repeat': False,
-                'msg': None,
-                'skip_requested': False,
-                'after_running': False,
-                'after_event': None
-            }
-            queue_data = self.guild_queues[guild_id]
-        else:
-            vc = queue_data['vc']
-            if not vc.is_connected():
-                vc = await channel.connect()
-                queue_data['vc'] = vc
+            player = GuildPlayer(guild_id, vc, interaction.channel_id)
+            self.players[guild_id] = player
+        elif not player.vc.is_connected():
+            player.vc = await channel.connect()
 
         try:
-            search_str = f"scsearch:{запрос}" if not запрос.startswith("http") else запрос
-            with yt_dlp.YoutubeDL(YTDL_OPTIONS) as ydl:
-                info = ydl.extract_info(search_str, download=False)
-
-            entries = info['entries'] if 'entries' in info else [info]
-            tracks = []
-            for entry in entries:
-                tracks.append({
-                    'url': entry.get('url'),
-                    'title': entry.get('title', 'Неизвестная песня'),
-                    'interaction': interaction,
-                    'uploader': entry.get('uploader', 'Неизвестен'),
-                    'duration_str': self.format_duration(entry.get('duration', 0)),
-                    'thumbnail': entry.get('thumbnail')
-                })
+            timeout = min(EXTRACT_TIMEOUT, self.interaction_time_left(interaction))
+            if timeout <= 0:
+                logger.warning(f"⏱ Запрос '{запрос}' пришёл слишком поздно, время ответа истекло (сервер {guild_id})")
+                await interaction.followup.send("⏱ Время ответа истекло, попробуйте ещё раз.", ephemeral=True)
+                return
+            found, playlist = await self.resolve(guild_id, запрос, timeout)
+            tracks = [track.copy(requester_id=interaction.user.id) for track in found]
+            for track in tracks:
+                track.requested_at = interaction.created_at.timestamp()
+        except asyncio.TimeoutError:
+            logger.warning(f"⏱ Поиск '{запрос}' не уложился в {timeout:.0f} с (сервер {guild_id})")
+            await interaction.followup.send("⏱ Поиск занял слишком много времени, попробуйте ещё раз.", ephemeral=True)
+            return
         except Exception as e:
             await interaction.followup.send(f"❌ Ошибка при поиске: {e}", ephemeral=True)
             return
@@ -430,24 +1332,114 @@ class Music(commands.Cog):
             await interaction.followup.send(f"❌ По запросу **{запрос}** ничего не найдено. Попробуйте изменить запрос.", ephemeral=True)
             return
 
+        if playlist:
+            # плейлист целиком идёт в очередь: первая порция — сразу, остальное — фоном
+            if not self.enqueue(guild_id, tracks):
+                await interaction.followup.send("❌ Плеер уже остановлен, запустите /музыка заново.", ephemeral=True)
+                return
+
+            player.playlist = playlist
+            if not playlist.done:
+                player.ingest_task = asyncio.create_task(
+                    self.ingest_playlist(player, playlist, interaction.user.id)
+                )
+
+            await interaction.followup.send(
+                f"📃 Плейлист **{playlist.title}**: в очереди {len(tracks)} тр."
+                + ("" if playlist.done else ", остальные догружаются..."),
+                ephemeral=True
+            )
+            return
+
         if len(tracks) > 1:
             await interaction.followup.send("🔎 Выберите трек из результатов:", view=TrackSelectView(self, guild_id, tracks), ephemeral=True)
             return
 
         track = tracks[0]
-        queue_data['queue'].append(track)
+        if not self.enqueue(guild_id, [track]):
+            await interaction.followup.send("❌ Плеер уже остановлен, запустите /музыка заново.", ephemeral=True)
+            return
 
-        msg = await interaction.followup.send(f"✅ Трек **{track['title']}** добавлен в очередь!", ephemeral=True)
+        msg = await interaction.followup.send(f"✅ Трек **{track.title}** добавлен в очередь!", ephemeral=True)
         await asyncio.sleep(3)
         try:
             await msg.delete()
         except Exception:
             pass
 
-        if queue_data.get('msg'):
-            await self.update_queue_embed(guild_id)
-        else:
-            asyncio.create_task(self.player_loop(guild_id))
+    # ------------------- Управление очередью -------------------
+    @app_commands.command(name="очередь_убрать", description="Убрать трек из очереди по номеру")
+    @app_commands.describe(номер="Номер трека в списке «Следующие треки»")
+    async def queue_remove(self, interaction, номер: int):
+        player = self.players.get(interaction.guild.id)
+        if not player or not (1 <= номер < len(player.queue)):
+            await interaction.response.send_message("❌ Нет трека с таким номером.", ephemeral=True)
+            return
+
+        track = player.remove(номер)
+        self.discard_stale_prefetch(player)
+        self.schedule_prefetch(player.guild_id)
+        self.schedule_embed_update(player.guild_id)
+
+        await interaction.response.send_message(f"🗑 Трек **{track.title}** убран из очереди.", ephemeral=True)
+
+    @app_commands.command(name="очередь_переместить", description="Переставить трек в очереди")
+    @app_commands.describe(откуда="Текущий номер трека", куда="Новый номер трека")
+    async def queue_move(self, interaction, откуда: int, куда: int):
+        player = self.players.get(interaction.guild.id)
+        size = len(player.queue) if player else 0
+        if not player or not (1 <= откуда < size) or not (1 <= куда < size):
+            await interaction.response.send_message("❌ Нет трека с таким номером.", ephemeral=True)
+            return
+
+        track = player.move(откуда, куда)
+        self.discard_stale_prefetch(player)
+        self.schedule_prefetch(player.guild_id)
+        self.schedule_embed_update(player.guild_id)
+
+        await interaction.response.send_message(f"↕️ Трек **{track.title}** теперь под номером {куда}.", ephemeral=True)
+
+
+    # ------------------- Диагностика -------------------
+    @app_commands.command(name="музыка_статистика", description="Задержки музыки на сервере (для администрации)")
+    async def music_stats(self, interaction):
+        if not interaction.user.guild_permissions.manage_guild:
+            await interaction.response.send_message("❌ Нет прав", ephemeral=True)
+            return
+
+        metrics = self.metrics.get(interaction.guild.id)
+        labels = {
+            "first_audio": "🎯 До первого звука",
+            "gap": "🔇 Пауза между треками",
+            "extract": "🔎 Извлечение yt_dlp",
+            "prepare": "⚙️ Подготовка источника",
+        }
+
+        embed = discord.Embed(title="📈 Статистика музыки", color=discord.Color.orange())
+        for name, label in labels.items():
+            stats = metrics.get(name)
+            embed.add_field(name=label, value=stats.describe() if stats else "нет данных", inline=False)
+
+        search, tracks = self.search_cache.stats(), self.track_cache.stats()
+        embed.add_field(
+            name="🗂 Кэш ссылок",
+            value=(f"поиск: {search['hits']}/{search['hits'] + search['misses']} попаданий, {search['size']} зап.\n"
+                   f"треки: {tracks['hits']}/{tracks['hits'] + tracks['misses']} попаданий, {tracks['size']} зап."),
+            inline=False
+        )
+        if self.disk_cache.enabled:
+            disk = self.disk_cache.stats()
+            embed.add_field(
+                name="💽 Аудио-кэш",
+                value=(f"{disk['files']} файлов, {disk['bytes'] // (1024 * 1024)} из "
+                       f"{disk['max_bytes'] // (1024 * 1024)} МБ, {disk['hits']} проигрываний с диска"),
+                inline=False
+            )
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        logger.info(f"📈 Музыка (сервер {interaction.guild.id}): " + "; ".join(
+            f"{name} {stats.describe()}" for name, stats in metrics.items()
+        ))
 
 
 async def setup(bot):
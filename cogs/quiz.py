@@ -1,28 +1,18 @@
-import os
 import discord
 from discord import app_commands
 from discord.ext import commands
 from discord.ui import View, Select, Button
 import random
 import logging
-import asyncio
 from config import load_config
-from supabase import create_client, Client
+from data import load_table
 
 CONFIG = load_config()
 logger = logging.getLogger("Quiz")
 
-# Supabase
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
 async def fetch_questions_from_supabase():
     try:
-        # Синхронный вызов execute в отдельном потоке
-        response = await asyncio.to_thread(lambda: supabase.table("quiz_questions").select("*").execute())
-
-        data = response.data  # тут уже список записей
+        data = await load_table("quiz_questions")  # список записей (из снимка или Supabase)
         if not data:
             logger.error("❌ Данных из Supabase нет.")
             return []
@@ -3,6 +3,8 @@ from discord.ext import commands
 import os
 import logging
 
+from data import store
+
 logger = logging.getLogger("role_reactions")
 
 class RoleReactionsWebhook(commands.Cog):
@@ -37,30 +39,29 @@ class RoleReactionsWebhook(commands.Cog):
             emoji: short for section in self.sections.values() for emoji, (short, _) in section.items()
         }
 
-        # Путь к файлу с ID сообщения
+        # Старый файл с ID сообщения — переносится в хранилище
         base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        data_folder = os.path.join(base_path, "data")
-        os.makedirs(data_folder, exist_ok=True)
-        self.role_message_file = os.path.join(data_folder, "role_message_id.txt")
+        self.role_message_file = os.path.join(base_path, "data", "role_message_id.txt")
 
         self.role_message_id = None
-        self.load_role_message_id()
 
-    def load_role_message_id(self):
-        """Загрузка ID сообщения из файла"""
-        if os.path.exists(self.role_message_file):
-            try:
-                with open(self.role_message_file, "r") as f:
-                    self.role_message_id = int(f.read().strip())
-                    logger.success(f"Загружен ID сообщения для ролей: {self.role_message_id}")
-            except Exception as e:
-                logger.warning(f"Не удалось загрузить ID сообщения: {e}")
-
-    def save_role_message_id(self):
-        """Сохранение ID сообщения в файл"""
+    async def cog_load(self):
+        await store.import_file("messages", self.role_message_file, lambda text: {"roles": int(text.strip())})
+        await self.load_role_message_id()
+
+    async def load_role_message_id(self):
+        """Загрузка ID сообщения из хранилища"""
+        try:
+            self.role_message_id = await store.get("messages", "roles")
+            if self.role_message_id:
+                logger.success(f"Загружен ID сообщения для ролей: {self.role_message_id}")
+        except Exception as e:
+            logger.warning(f"Не удалось загрузить ID сообщения: {e}")
+
+    async def save_role_message_id(self):
+        """Сохранение ID сообщения в хранилище"""
         try:
-            with open(self.role_message_file, "w") as f:
-                f.write(str(self.role_message_id))
+            await store.set("messages", "roles", self.role_message_id)
             logger.success(f"Сохранён ID сообщения: {self.role_message_id}")
         except Exception as e:
             logger.error(f"Не удалось сохранить ID сообщения: {e}")
@@ -101,7 +102,7 @@ class RoleReactionsWebhook(commands.Cog):
             await message.add_reaction(emoji)
 
         self.role_message_id = message.id
-        self.save_role_message_id()
+        await self.save_role_message_id()
         logger.success(f"Создано новое сообщение для ролей с ID {self.role_message_id}")
 
     @commands.Cog.listener()
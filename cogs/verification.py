@@ -1,11 +1,11 @@
 import discord
 from discord.ext import commands
 import json
-import os
 import aiohttp
 import logging
 import asyncio
 from config import load_config
+from data import store
 
 config = load_config()
 logger = logging.getLogger("Verification")
@@ -17,7 +17,8 @@ class Verification(commands.Cog):
         self.verify_channel_id = config.get("VERIFY_CHANNEL_ID")
         self.verified_role_id = config.get("VERIFIED_ROLE_ID")
         self.verify_emoji = config.get("VERIFY_EMOJI", "✅")
-        self.msg_file = "data/verify_message.json"
+        self.msg_file = "data/verify_message.json"  # старый файл, переносится в хранилище
+        self.message_id = None
         self.avatar_url = config.get("AVATAR_URL")
 
     async def get_avatar_bytes(self, url):
@@ -35,23 +36,30 @@ class Verification(commands.Cog):
             logger.error(f"Ошибка при загрузке аватара: {e}")
         return None
 
-    def save_message_id(self, msg_id):
+    async def cog_load(self):
+        await store.import_file(
+            "messages", self.msg_file,
+            lambda text: {"verify": json.loads(text).get("message_id")}
+        )
+        self.message_id = await self.load_message_id()
+
+    async def save_message_id(self, msg_id):
+        self.message_id = msg_id
         try:
-            os.makedirs(os.path.dirname(self.msg_file), exist_ok=True)
-            with open(self.msg_file, "w") as f:
-                json.dump({"message_id": msg_id}, f)
+            await store.set("messages", "verify", msg_id)
             logger.success(f"Сохранено сообщение верификации с ID {msg_id}")
         except Exception as e:
             logger.error(f"Ошибка при сохранении message_id: {e}")
 
-    def load_message_id(self):
-        if os.path.exists(self.msg_file):
-            try:
-                return json.load(open(self.msg_file, "r")).get("message_id")
-            except Exception as e:
-                logger.error(f"Ошибка при чтении message_id: {e}")
-        logger.debug("Файл message_id не найден, нужно создать новое сообщение")
-        return None
+    async def load_message_id(self):
+        try:
+            msg_id = await store.get("messages", "verify")
+        except Exception as e:
+            logger.error(f"Ошибка при чтении message_id: {e}")
+            return None
+        if msg_id is None:
+            logger.debug("ID сообщения верификации не найден, нужно создать новое сообщение")
+        return msg_id
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -60,7 +68,7 @@ class Verification(commands.Cog):
             logger.warning(f"Канал с ID {self.verify_channel_id} не найден!")
             return
 
-        msg_id = self.load_message_id()
+        msg_id = self.message_id
         if msg_id:
             try:
                 await channel.fetch_message(msg_id)
@@ -94,7 +102,7 @@ class Verification(commands.Cog):
                 avatar_url=self.avatar_url
             )
             await msg.add_reaction(self.verify_emoji)
-            self.save_message_id(msg.id)
+            await self.save_message_id(msg.id)
             logger.success("Сообщение верификации создано и реакция добавлена.")
         except Exception as e:
             logger.error(f"Ошибка при создании сообщения через вебхук: {e}")
@@ -103,7 +111,7 @@ class Verification(commands.Cog):
     async def on_raw_reaction_add(self, payload):
         if payload.user_id == self.bot.user.id or payload.channel_id != self.verify_channel_id:
             return
-        if payload.message_id != self.load_message_id() or str(payload.emoji) != self.verify_emoji:
+        if payload.message_id != self.message_id or str(payload.emoji) != self.verify_emoji:
             return
 
         guild = self.bot.get_guild(payload.guild_id)
@@ -135,7 +143,7 @@ class Verification(commands.Cog):
     async def on_raw_reaction_remove(self, payload):
         if payload.channel_id != self.verify_channel_id:
             return
-        if payload.message_id != self.load_message_id() or str(payload.emoji) != self.verify_emoji:
+        if payload.message_id != self.message_id or str(payload.emoji) != self.verify_emoji:
             return
 
         guild = self.bot.get_guild(payload.guild_id)
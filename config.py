@@ -1,4 +1,6 @@
 from dotenv import load_dotenv
+from datetime import datetime
+from zoneinfo import ZoneInfo
 import os
 import logging
 
@@ -63,8 +65,35 @@ def load_config():
         "REPO_NAME": os.getenv("REPO_NAME", "Legion-Of-The-Damned/-VS-Data-Base"),
         "SUPABASE_URL": os.getenv("SUPABASE_URL"),
         "SUPABASE_KEY": os.getenv("SUPABASE_KEY"),
+        # таймаут одного запроса (с) и сколько запросов к Supabase идут одновременно
+        "SUPABASE_TIMEOUT": getenv_int("SUPABASE_TIMEOUT", 10),
+        "SUPABASE_CONCURRENCY": getenv_int("SUPABASE_CONCURRENCY", 4),
+        # локальный снимок данных из Supabase для старта без сети
+        "DATA_SNAPSHOT_PATH": os.getenv("DATA_SNAPSHOT_PATH", "data/snapshot.json"),
+        # очередь записей в Supabase, переживающая обрывы сети и перезапуски
+        "DATA_OUTBOX_PATH": os.getenv("DATA_OUTBOX_PATH", "data/outbox.jsonl"),
+        # SQLite-хранилище локального состояния модулей (подписки, напоминания, ID сообщений)
+        "LOCAL_STORE_PATH": os.getenv("LOCAL_STORE_PATH", "data/bot.db"),
+        # часовой пояс планировщика (например Europe/Moscow); пусто — системный
+        "TIMEZONE": os.getenv("BOT_TIMEZONE", ""),
+        # рассылка личных сообщений: одновременных отправок и повторов при временных ошибках
+        "DM_CONCURRENCY": getenv_int("DM_CONCURRENCY", 5),
+        "DM_RETRIES": getenv_int("DM_RETRIES", 3),
+
+        # локальный кэш аудио для музыки; пустая папка — кэш выключен
+        "MUSIC_CACHE_DIR": os.getenv("MUSIC_CACHE_DIR", ""),
+        "MUSIC_CACHE_MAX_MB": getenv_int("MUSIC_CACHE_MAX_MB", 300),
+        "MUSIC_CACHE_MIN_PLAYS": getenv_int("MUSIC_CACHE_MIN_PLAYS", 3),
 
         "QUIZ_QUESTIONS_PATH": "quiz_questions.json"
     }
 
-    return config
\ No newline at end of file
+    return config
+
+
+def default_timezone():
+    """Часовой пояс бота из BOT_TIMEZONE, иначе системный (как у datetime.now())."""
+    name = load_config()["TIMEZONE"]
+    if name:
+        return ZoneInfo(name)
+    return datetime.now().astimezone().tzinfo
\ No newline at end of file
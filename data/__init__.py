@@ -1,10 +1,22 @@
 from .data import (
     stats,
+    period_stats,
     active_duels,
     get_stats,
     get_active_duels,
     update_stats,
+    flush_stats,
     save_active_duels,
     load_data,
+    load_table,
+    reconciled,
+    periods_reconciled,
+    outbox,
+    migrate_to_user_ids,
     key_from_name,
-)
\ No newline at end of file
+)
+from .gateway import gateway, SupabaseGateway, CircuitBreaker, CircuitOpenError
+from .outbox import Outbox
+from .store import store, LocalStore
+from .leaderboard import Leaderboard, StatRecord
+from .periods import PeriodStats, PERIODS
\ No newline at end of file
@@ -1,26 +1,98 @@
 import asyncio
 import logging
+import time
 from datetime import datetime
-from supabase import create_client, Client
 from config import load_config
+from .gateway import gateway, CircuitOpenError
+from .snapshot import Snapshot
+from .outbox import Outbox
+from .leaderboard import Leaderboard
+from .periods import PeriodStats
 import re
 
 logger = logging.getLogger("supabase_data")
 
-# --- Конфигурация Supabase ---
 config = load_config()
-SUPABASE_URL = config["SUPABASE_URL"]
-SUPABASE_KEY = config["SUPABASE_KEY"]
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+DUEL_FINISHED = "finished"  # статус архивной дуэли в таблице active_duels
+
+# Постраничная загрузка: только нужные боту столбцы, по LOAD_PAGE_SIZE строк
+LOAD_PAGE_SIZE = 500
+
+def columns(*names):
+    """Список столбцов для select; имена с пробелами и кириллицей — в кавычках."""
+    return ",".join(f'"{name}"' for name in names)
+
+DUEL_COLUMNS = columns("Игрок 1", "Игрок 2", "Игрок 1 ID", "Игрок 2 ID", "Игра", "Время", "Статус", "Время начала")
+DUEL_ORDER = ('"Игрок 1 ID"', '"Игрок 2 ID"', '"Игрок 1"', '"Игрок 2"')
+STATS_COLUMNS = columns("ID", "Игрок", "Побед", "Поражений")
+STATS_ORDER = ('"ID"', '"Игрок"')
+PERIOD_COLUMNS = columns("Период", "ID", "Игрок", "Побед", "Поражений")
+PERIOD_ORDER = ('"Период"', '"ID"', '"Игрок"')
+
+
+class DuelStore(dict):
+    """
+    Словарь активных дуэлей, который помнит, что изменилось с последней записи:
+    changed — созданные/обновлённые дуэли, removed — завершённые (уходят в архив).
+    Модули работают с ним как с обычным dict; после правки дуэли «на месте»
+    нужно вызвать touch(duel_id).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.changed = set()
+        self.removed = {}  # duel_id -> дуэль на момент удаления
+
+    def __setitem__(self, duel_id, duel):
+        super().__setitem__(duel_id, duel)
+        self.removed.pop(duel_id, None)
+        self.changed.add(duel_id)
+
+    def __delitem__(self, duel_id):
+        self.removed[duel_id] = self[duel_id]
+        self.changed.discard(duel_id)
+        super().__delitem__(duel_id)
+
+    def pop(self, duel_id, *default):
+        if duel_id in self:
+            duel = self[duel_id]
+            del self[duel_id]
+            return duel
+        return super().pop(duel_id, *default)
+
+    def touch(self, duel_id):
+        if duel_id in self:
+            self.changed.add(duel_id)
+
+    def load(self, duel_id, duel):
+        """Добавление из базы — без пометки на запись."""
+        super().__setitem__(duel_id, duel)
+
+    def discard(self, duel_id):
+        """Удаление дуэли, уже завершённой в базе, — тоже без пометки."""
+        if duel_id in self:
+            super().__delitem__(duel_id)
+
+    def take_changes(self):
+        changed = {duel_id: self[duel_id] for duel_id in self.changed if duel_id in self}
+        removed = self.removed
+        self.changed, self.removed = set(), {}
+        return changed, removed
+
 
 # --- Глобальные переменные ---
-stats = {}          # ключи — нормализованные имена (без префиксов)
-active_duels = {}   # ключи — "player1ID-player2ID"
+stats = Leaderboard()       # ключи — ID участников Discord
+active_duels = DuelStore()  # ключи — "player1ID-player2ID"
+period_stats = PeriodStats()  # корзины по дням/месяцам для рейтингов за период
+snapshot = Snapshot(config["DATA_SNAPSHOT_PATH"])
+outbox = Outbox(config["DATA_OUTBOX_PATH"], gateway)  # все изменения данных идут через неё
+reconciled = asyncio.Event()  # дуэли и статистика сверены с Supabase хотя бы раз
+periods_reconciled = asyncio.Event()  # то же для duel_stats_periods (грузится отдельно)
 
 # --- Вспомогательные функции ---
 def key_from_name(name: str) -> str:
-    """Возвращает ключ для stats без префиксов, в нижнем регистре"""
+    """Имя без префиксов клана, в нижнем регистре — только для переноса старых строк"""
     return re.sub(r"\[.*?\]\s*", "", name).lower()
 
 async def get_username_by_id(bot, user_id: int) -> str:
@@ -30,139 +102,618 @@ async def get_username_by_id(bot, user_id: int) -> str:
     except Exception:
         return str(user_id)
 
-# --- Загрузка данных из Supabase ---
+# Строки, сохранённые ещё по именам (до перехода на ID); их переносит migrate_to_user_ids
+legacy_rows = {"active_duels": [], "duel_stats": [], "duel_stats_periods": []}
+
+def duel_from_row(row, player1_id, player2_id):
+    return {
+        # универсальные ключи для старого и нового кода
+        "player1": row.get("Игрок 1"),
+        "player2": row.get("Игрок 2"),
+        "challenger_id": int(player1_id),
+        "opponent_id": int(player2_id),
+        "game": row.get("Игра"),
+        "time": row.get("Время"),
+        "status": row.get("Статус"),
+        "start_time": row.get("Время начала")
+    }
+
+# --- Локальный снимок ---
+def snapshot_state():
+    """Всё, что нужно для старта без сети, включая ещё не записанные в Supabase изменения."""
+    return {
+        "active_duels": dict(active_duels),
+        "stats": [[r.key, r.display_name, r.wins, r.losses] for r in stats.values()],
+        "periods": [
+            [bucket_id, key, r.display_name, r.wins, r.losses]
+            for bucket_id, bucket in period_stats.buckets.items()
+            for key, r in bucket.items()
+        ],
+        "pending": {
+            "stats": list(stats_writer.dirty),
+            "periods": [list(pair) for pair in stats_writer.dirty_periods],
+            "removed_periods": list(stats_writer.removed_periods),
+            "deltas": [[key, *delta] for key, delta in stats_writer.deltas.items()],
+            "period_deltas": [[*pair, *delta] for pair, delta in stats_writer.period_deltas.items()],
+            "duels_changed": list(active_duels.changed),
+            "duels_removed": active_duels.removed,
+        },
+    }
+
+def restore_snapshot():
+    state = snapshot.load()
+    for duel_id, duel in state.get("active_duels", {}).items():
+        active_duels.load(duel_id, duel)
+    for key, name, wins, losses in state.get("stats", []):
+        stats.set(key, name, wins, losses)
+    for bucket_id, key, name, wins, losses in state.get("periods", []):
+        period_stats.load_row(bucket_id, key, name, wins, losses)
+
+    # изменения, сделанные без сети в прошлый запуск, — их ещё нужно дописать
+    pending = state.get("pending", {})
+    stats_writer.dirty.update(pending.get("stats", []))
+    stats_writer.dirty_periods.update(tuple(pair) for pair in pending.get("periods", []))
+    stats_writer.removed_periods.update(pending.get("removed_periods", []))
+    stats_writer.deltas.update({key: [wins, losses] for key, wins, losses in pending.get("deltas", [])})
+    stats_writer.period_deltas.update(
+        {(bucket_id, key): [wins, losses] for bucket_id, key, wins, losses in pending.get("period_deltas", [])}
+    )
+    active_duels.changed.update(pending.get("duels_changed", []))
+    active_duels.removed.update(pending.get("duels_removed", {}))
+    return bool(state)
+
+# --- Загрузка данных ---
 async def load_data():
-    global stats, active_duels
+    """
+    Стартует из локального снимка без ожидания сети, сверка с Supabase идёт в фоне.
+    Без снимка (первый запуск) один раз ждём Supabase, дальше — фоновые повторы.
+    Неотправленные записи из outbox начинают отправляться сразу.
+    """
+    await outbox.load()
+    outbox.start()
+    asyncio.create_task(reconcile_periods())
+
+    if restore_snapshot():
+        logger.info(f"📦 Из снимка: {len(active_duels)} дуэлей, {len(stats)} игроков; сверка с Supabase в фоне")
+        asyncio.create_task(reconcile())
+        return
+
     try:
-        # --- Активные дуэли ---
-        resp_duels = supabase.table("active_duels").select("*").execute()
-        for duel in resp_duels.data:
-            player1_name = duel.get("Игрок 1")
-            player2_name = duel.get("Игрок 2")
-            player1_id = duel.get("Игрок 1 ID")
-            player2_id = duel.get("Игрок 2 ID")
-
-            duel_id = f"{player1_id or player1_name}-{player2_id or player2_name}"
-
-            active_duels[duel_id] = {
-                # универсальные ключи для старого и нового кода
-                "player1": player1_name,
-                "player2": player2_name,
-                "challenger_id": int(player1_id) if player1_id else None,
-                "opponent_id": int(player2_id) if player2_id else None,
-                "game": duel.get("Игра"),
-                "time": duel.get("Время"),
-                "status": duel.get("Статус"),
-                "start_time": duel.get("Время начала")
-            }
-
-        # --- Статистика ---
-        resp_stats = supabase.table("duel_stats").select("*").execute()
-        for row in resp_stats.data:
-            user_name = row["Игрок"]
-            user_key = key_from_name(user_name)
-            stats[user_key] = {
-                "display_name": user_name,
-                "wins": int(row["Побед"]),
-                "losses": int(row["Поражений"]),
-                "total": int(row["Всего"])
-            }
-
-        logger.info("✅ Данные из Supabase загружены")
+        await fetch_remote()
+        await after_reconcile()
     except Exception as e:
         logger.error(f"⚠️ Ошибка загрузки данных из Supabase: {e}")
+        asyncio.create_task(reconcile())
 
-async def save_duel_to_db(duel, bot):
-    player1_name = duel.get("player1") or str(duel.get("challenger_id"))
-    player2_name = duel.get("player2") or str(duel.get("opponent_id"))
+async def reconcile(delay=30, max_delay=600):
+    """Повторяет загрузку из Supabase, пока база не станет доступна."""
+    while True:
+        try:
+            await fetch_remote()
+            break
+        except Exception as e:
+            logger.error(f"⚠️ Ошибка загрузки данных из Supabase: {e} — повтор через {delay} с")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+    await after_reconcile()
 
-    if not player1_name or not player2_name:
-        logger.error(f"⚠️ Недостаточно игроков для сохранения дуэли: {duel}")
+async def reconcile_periods(delay=30, max_delay=600):
+    """
+    Статистика по периодам грузится отдельно: её ошибка (например, таблица ещё
+    не создана) не держит основную сверку и перенос на ID.
+    """
+    while True:
+        try:
+            await fetch_periods()
+            break
+        except Exception as e:
+            logger.error(f"⚠️ Ошибка загрузки duel_stats_periods: {e} — повтор через {delay} с")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+    periods_reconciled.set()
+    snapshot.schedule()
+    if stats_writer.pending:
+        stats_writer.start()
+
+async def after_reconcile():
+    reconciled.set()
+    snapshot.schedule()
+    # дописываем то, что накопилось, пока базы не было
+    if stats_writer.pending:
+        stats_writer.start()
+    if active_duels.changed or active_duels.removed:
+        await save_active_duels()
+
+def report_legacy(table, rows):
+    legacy_rows[table] = rows
+    if rows:
+        logger.warning(f"⚠️ {table}: {len(rows)} строк ещё записаны по именам — будут перенесены на ID после подключения к Discord")
+
+async def fetch_remote():
+    """
+    Загружает основные таблицы (дуэли и статистику) из Supabase постранично
+    и сливает с памятью по мере чтения. Локальные изменения, ещё не записанные
+    в базу, важнее данных из базы. Слияние идемпотентно, поэтому обрыв
+    посередине просто повторяется целиком.
+    """
+    await fetch_duels()
+    await fetch_stats()
+    logger.info("✅ Данные из Supabase загружены")
+
+async def fetch_duels():
+    legacy = []
+    async for duel in gateway.select_pages("active_duels", DUEL_COLUMNS, DUEL_ORDER, LOAD_PAGE_SIZE):
+        player1_id = duel.get("Игрок 1 ID")
+        player2_id = duel.get("Игрок 2 ID")
+        if not player1_id or not player2_id:
+            if duel.get("Статус") != DUEL_FINISHED:
+                legacy.append(duel)
+            continue
+
+        duel_id = f"{player1_id}-{player2_id}"
+        # строки, ещё ждущие отправки в outbox, новее базы — их не трогаем
+        if (duel_id in active_duels.changed or duel_id in active_duels.removed
+                or outbox.has("active_duels", "upsert", duel_id)):
+            continue
+        if duel.get("Статус") == DUEL_FINISHED:
+            active_duels.discard(duel_id)
+            continue
+        active_duels.load(duel_id, duel_from_row(duel, player1_id, player2_id))
+    report_legacy("active_duels", legacy)
+
+async def fetch_stats():
+    legacy = []
+    async for row in gateway.select_pages("duel_stats", STATS_COLUMNS, STATS_ORDER, LOAD_PAGE_SIZE):
+        if row.get("ID") is None:
+            legacy.append(row)
+            continue
+        key = int(row["ID"])
+        # результаты, засчитанные до сверки, прибавляются к счёту из базы
+        delta = stats_writer.deltas.get(key)
+        if delta is not None:
+            record = stats.get(key)
+            name = record.display_name if record else row["Игрок"]
+            stats.set(key, name, int(row["Побед"]) + delta[0], int(row["Поражений"]) + delta[1])
+            continue
+        # строки, ещё ждущие отправки в outbox, новее базы — их не трогаем
+        if key in stats_writer.dirty or outbox.has("duel_stats", "upsert", row["ID"]):
+            continue
+        stats.set(key, row["Игрок"], int(row["Побед"]), int(row["Поражений"]))
+    stats_writer.deltas.clear()
+    report_legacy("duel_stats", legacy)
+
+async def fetch_periods():
+    legacy = []
+    # дни, свёрнутые в месяц, но ещё не удалённые из базы, не загружаем — иначе свернём их повторно
+    deleting = outbox.deleting("duel_stats_periods", "Период")
+    async for row in gateway.select_pages("duel_stats_periods", PERIOD_COLUMNS, PERIOD_ORDER, LOAD_PAGE_SIZE):
+        if row.get("ID") is None:
+            legacy.append(row)
+            continue
+        pair = (row["Период"], int(row["ID"]))
+        delta = stats_writer.period_deltas.get(pair)
+        if delta is not None:
+            record = period_stats.buckets.get(pair[0], {}).get(pair[1])
+            name = record.display_name if record else row["Игрок"]
+            period_stats.load_row(*pair, name, int(row["Побед"]) + delta[0], int(row["Поражений"]) + delta[1])
+            continue
+        # строки, ещё ждущие отправки в outbox, новее базы — их не трогаем
+        if (pair in stats_writer.dirty_periods
+                or row["Период"] in stats_writer.removed_periods
+                or row["Период"] in deleting
+                or outbox.has("duel_stats_periods", "upsert", f"{row['Период']}:{row['ID']}")):
+            continue
+        period_stats.load_row(
+            row["Период"], int(row["ID"]), row["Игрок"],
+            int(row["Побед"]), int(row["Поражений"])
+        )
+    stats_writer.period_deltas.clear()
+    compacted, removed = period_stats.compact()
+    if compacted or removed:
+        stats_writer.mark_periods(compacted, removed)
+    report_legacy("duel_stats_periods", legacy)
+    logger.info("✅ Статистика по периодам загружена из Supabase")
+
+# --- Справочные таблицы (вопросы викторины, информация о сервере) ---
+table_refresh = {}  # таблица -> задача фонового обновления
+
+async def load_table(table, max_age=600):
+    """
+    Строки справочной таблицы: сразу из снимка, а если он старше max_age —
+    обновление из Supabase в фоне. Без снимка ждём Supabase.
+    """
+    rows, updated_at = snapshot.table(table)
+    if rows is None:
+        return await refresh_table(table)
+
+    task = table_refresh.get(table)
+    if time.time() - updated_at > max_age and (task is None or task.done()):
+        table_refresh[table] = asyncio.create_task(refresh_table(table))
+    return rows
+
+async def refresh_table(table):
+    try:
+        rows = await gateway.select(table)
+    except CircuitOpenError as e:
+        # база недавно не отвечала — не ждём таймаута, отдаём копию
+        logger.warning(f"🔌 {table}: {e}, используется локальная копия")
+        rows, _ = snapshot.table(table)
+        return rows or []
+    except Exception as e:
+        logger.error(f"⚠️ Не удалось обновить {table} из Supabase: {e}")
+        rows, _ = snapshot.table(table)
+        return rows or []
+    snapshot.set_table(table, rows)
+    return rows
+
+# --- Перенос статистики с имён на ID ---
+async def claim_legacy_rows(table, id_values, match):
+    """
+    Проставляет ID строкам, записанным по имени (UPDATE ... WHERE ID IS NULL AND match).
+    Одна операция на стороне базы и идемпотентна: повтор уже ничего не найдёт.
+    """
+    id_column = next(iter(id_values))
+
+    def build(query):
+        query = query.update(id_values).is_(id_column, "null")
+        for column, value in match.items():
+            query = query.eq(column, value)
+        return query
+
+    return await gateway.run(table, "update", build)
+
+async def delete_legacy_rows(table, names, match=None):
+    """Удаляет строки по именам (ID IS NULL); возвращает действительно удалённые."""
+    def build(query):
+        query = query.delete().is_("ID", "null").in_("Игрок", names)
+        for column, value in (match or {}).items():
+            query = query.eq(column, value)
+        return query
+
+    return await gateway.run(table, "delete", build)
+
+async def migrate_to_user_ids(bot):
+    """
+    Одноразовый перенос строк, записанных по отображаемым именам, на ID участников.
+    Имена сопоставляются с участниками серверов бота один раз; ник на сервере
+    важнее имени пользователя, а имя, подходящее нескольким участникам, не переносится.
+    Если у участника ещё нет ID-строки, первой его строке по имени ID проставляется
+    на месте (UPDATE), остальные удаляются, а их счёт прибавляется к ID-строке.
+    Прибавляется только то, что база подтвердила как удалённое, поэтому повтор
+    после сбоя ничего не посчитает дважды. Несопоставленные строки остаются в базе.
+
+    Требуемая схема: в duel_stats снять UNIQUE("Игрок") и добавить UNIQUE("ID"),
+    в duel_stats_periods — UNIQUE("Период", "ID") вместо UNIQUE("Период", "Игрок"),
+    в active_duels — UNIQUE("Игрок 1 ID", "Игрок 2 ID").
+    """
+    if not any(legacy_rows.values()):
         return
 
-    status = duel.get("status", "active")
+    # имя -> кандидаты {ID: ник}; отдельно совпадения по нику на сервере
+    # и по имени пользователя/глобальному имени — ник надёжнее
+    by_display, by_account = {}, {}
+    for guild in bot.guilds:
+        for member in guild.members:
+            by_display.setdefault(key_from_name(member.display_name), {})[member.id] = member.display_name
+            for name in (member.global_name, member.name):
+                if name:
+                    by_account.setdefault(key_from_name(name), {})[member.id] = member.display_name
+
+    members, ambiguous = {}, []
+    for key in by_display.keys() | by_account.keys():
+        candidates = by_display.get(key) or by_account[key]
+        if len(candidates) > 1:
+            ambiguous.append(key)
+            continue
+        members[key] = next(iter(candidates.items()))
+    legacy_names = {
+        key_from_name(row[column])
+        for table, rows in legacy_rows.items()
+        for row in rows
+        for column in (("Игрок 1", "Игрок 2") if table == "active_duels" else ("Игрок",))
+        if row.get(column)
+    }
+    ambiguous = sorted(legacy_names.intersection(ambiguous))
+    if ambiguous:
+        logger.warning(f"⚠️ Перенос на ID: имя подходит нескольким участникам, строки пропущены: {', '.join(ambiguous)}")
+
+    def resolve(name):
+        return members.get(key_from_name(name)) if name else None
+
+    def group(rows, key_of):
+        groups = {}
+        for row in rows:
+            match = resolve(row["Игрок"])
+            if match is not None:
+                groups.setdefault(key_of(row, match[0]), [match[1], []])[1].append(row)
+        return groups
+
+    def counts(rows):
+        return sum(int(row["Побед"]) for row in rows), sum(int(row["Поражений"]) for row in rows)
+
+    # --- duel_stats ---
+    migrated = 0
+    for user_id, (display_name, group_rows) in group(legacy_rows["duel_stats"], lambda row, user_id: user_id).items():
+        rows = group_rows
+        try:
+            record = stats.get(user_id)
+            if record is None:
+                first, rows = rows[0], rows[1:]
+                await claim_legacy_rows("duel_stats", {"ID": user_id, "Игрок": display_name}, {"Игрок": first["Игрок"]})
+                wins, losses = counts([first])
+            else:
+                wins, losses = record.wins, record.losses
+
+            if rows:
+                deleted = await delete_legacy_rows("duel_stats", [row["Игрок"] for row in rows])
+                extra_wins, extra_losses = counts(deleted)
+                wins, losses = wins + extra_wins, losses + extra_losses
+                stats_writer.mark(user_id)
+            stats.set(user_id, display_name, wins, losses)
+        except Exception as e:
+            logger.error(f"⚠️ Ошибка переноса duel_stats на ID {user_id}: {e}")
+            continue
+        legacy_rows["duel_stats"] = [row for row in legacy_rows["duel_stats"] if row not in group_rows]
+        migrated += 1
+    if migrated:
+        logger.info(f"🔁 duel_stats: строки по именам перенесены на {migrated} ID")
+
+    # --- duel_stats_periods ---
+    migrated = 0
+    groups = group(legacy_rows["duel_stats_periods"], lambda row, user_id: (row["Период"], user_id))
+    for (period, user_id), (display_name, group_rows) in groups.items():
+        rows = group_rows
+        try:
+            record = period_stats.buckets.get(period, {}).get(user_id)
+            if record is None:
+                first, rows = rows[0], rows[1:]
+                await claim_legacy_rows(
+                    "duel_stats_periods", {"ID": user_id, "Игрок": display_name},
+                    {"Период": period, "Игрок": first["Игрок"]}
+                )
+                wins, losses = counts([first])
+            else:
+                wins, losses = record.wins, record.losses
+
+            if rows:
+                deleted = await delete_legacy_rows(
+                    "duel_stats_periods", [row["Игрок"] for row in rows], {"Период": period}
+                )
+                extra_wins, extra_losses = counts(deleted)
+                wins, losses = wins + extra_wins, losses + extra_losses
+                stats_writer.mark_periods([(period, user_id)])
+            period_stats.load_row(period, user_id, display_name, wins, losses)
+        except Exception as e:
+            logger.error(f"⚠️ Ошибка переноса duel_stats_periods {period} на ID {user_id}: {e}")
+            continue
+        legacy_rows["duel_stats_periods"] = [
+            row for row in legacy_rows["duel_stats_periods"] if row not in group_rows
+        ]
+        migrated += 1
+    if migrated:
+        logger.info(f"🔁 duel_stats_periods: перенесено {migrated} строк")
+
+    # --- active_duels ---
+    for row in list(legacy_rows["active_duels"]):
+        player1, player2 = resolve(row.get("Игрок 1")), resolve(row.get("Игрок 2"))
+        if player1 is None or player2 is None:
+            continue
+        duel_id = f"{player1[0]}-{player2[0]}"
+        names = {"Игрок 1": row.get("Игрок 1"), "Игрок 2": row.get("Игрок 2")}
+        try:
+            if duel_id in active_duels:
+                # дуэль с этими ID уже есть — старая строка лишняя
+                await gateway.run(
+                    "active_duels", "delete",
+                    lambda query: query.delete().is_("Игрок 1 ID", "null")
+                    .eq("Игрок 1", names["Игрок 1"]).eq("Игрок 2", names["Игрок 2"])
+                )
+            else:
+                await claim_legacy_rows(
+                    "active_duels", {"Игрок 1 ID": player1[0], "Игрок 2 ID": player2[0]}, names
+                )
+                active_duels.load(duel_id, duel_from_row(row, player1[0], player2[0]))
+        except Exception as e:
+            logger.error(f"⚠️ Ошибка переноса дуэли {names['Игрок 1']} vs {names['Игрок 2']} на ID: {e}")
+            continue
+        legacy_rows["active_duels"].remove(row)
+
+    left = sum(len(rows) for rows in legacy_rows.values())
+    if left:
+        logger.warning(f"⚠️ {left} строк по именам не удалось сопоставить с участниками")
+
+def duel_row(duel, status=None):
+    """Строка таблицы active_duels для дуэли; None, если не хватает игроков."""
+    player1_id = duel.get("challenger_id")
+    player2_id = duel.get("opponent_id")
+
+    if not player1_id or not player2_id:
+        logger.error(f"⚠️ Недостаточно игроков для сохранения дуэли: {duel}")
+        return None
+
+    status = status or duel.get("status", "active")
     start_time_raw = duel.get("start_time")
     try:
         start_time = datetime.fromisoformat(start_time_raw).strftime("%Y-%m-%d %H:%M:%S")
     except Exception:
         start_time = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
-    data_to_save = {
-        "Игрок 1": player1_name,
-        "Игрок 2": player2_name,
+    return {
+        "Игрок 1": duel.get("player1") or str(player1_id),
+        "Игрок 2": duel.get("player2") or str(player2_id),
+        "Игрок 1 ID": player1_id,
+        "Игрок 2 ID": player2_id,
         "Игра": duel.get("game", "Не указано"),
         "Время": duel.get("time", "Не указано"),
         "Статус": status,
         "Время начала": start_time
     }
 
-    try:
-        supabase.table("active_duels").upsert(
-            data_to_save,
-            on_conflict=["Игрок 1", "Игрок 2"]
-        ).execute()
-        logger.info(f"💾 Дуэль {player1_name} vs {player2_name} сохранена в Supabase")
-    except Exception as e:
-        logger.error(f"⚠️ Ошибка при сохранении дуэли в Supabase: {e}")
+async def save_duel_to_db(duel, bot):
+    data_to_save = duel_row(duel)
+    if data_to_save is None:
+        return
+    duel_id = f"{data_to_save['Игрок 1 ID']}-{data_to_save['Игрок 2 ID']}"
+    outbox.upsert("active_duels", data_to_save, key=duel_id, on_conflict=["Игрок 1 ID", "Игрок 2 ID"])
+    logger.info(f"💾 Дуэль {data_to_save['Игрок 1']} vs {data_to_save['Игрок 2']} поставлена в очередь записи")
 
 # --- Обновление статистики после дуэли ---
-def update_stats(winner_name, loser_name):
-    global stats
-    winner_key = key_from_name(winner_name)
-    loser_key = key_from_name(loser_name)
-
-    # Инициализация при необходимости
-    if winner_key not in stats:
-        stats[winner_key] = {"display_name": winner_name, "wins": 0, "losses": 0, "total": 0}
-    if loser_key not in stats:
-        stats[loser_key] = {"display_name": loser_name, "wins": 0, "losses": 0, "total": 0}
-
-    # Обновление счетчиков
-    stats[winner_key]["wins"] = int(stats[winner_key]["wins"]) + 1
-    stats[loser_key]["losses"] = int(stats[loser_key]["losses"]) + 1
-    stats[winner_key]["total"] = stats[winner_key]["wins"] + stats[winner_key]["losses"]
-    stats[loser_key]["total"] = stats[loser_key]["wins"] + stats[loser_key]["losses"]
-
-    # Асинхронное сохранение в Supabase
-    asyncio.create_task(save_stats_to_db(winner_key, loser_key))
-
-# --- Сохранение статистики ---
-async def save_stats_to_db(winner_key, loser_key):
-    winner = stats[winner_key]
-    loser = stats[loser_key]
+def update_stats(winner_id, winner_name, loser_id, loser_name):
+    """Засчитывает дуэль; ключи — ID участников, имена хранятся только как подписи."""
+    # Счётчики и место в рейтинге обновляются сразу
+    stats.add_result(winner_id, winner_name, wins=1)
+    stats.add_result(loser_id, loser_name, losses=1)
 
-    try:
-        supabase.table("duel_stats").upsert({
-            "Игрок": winner["display_name"],
-            "Побед": int(winner["wins"]),
-            "Поражений": int(winner["losses"]),
-            "Всего": int(winner["total"])
-        }, on_conflict=["Игрок"]).execute()
-
-        supabase.table("duel_stats").upsert({
-            "Игрок": loser["display_name"],
-            "Побед": int(loser["wins"]),
-            "Поражений": int(loser["losses"]),
-            "Всего": int(loser["total"])
-        }, on_conflict=["Игрок"]).execute()
-
-        logger.info(f"💾 Статистика игроков {winner['display_name']} и {loser['display_name']} сохранена в Supabase")
-    except Exception as e:
-        logger.error(f"⚠️ Ошибка сохранения статистики в Supabase: {e}")
+    # Корзина текущего дня для рейтингов за день/неделю/месяц
+    buckets = period_stats.record(winner_id, winner_name, loser_id, loser_name)
+    # старые дни сворачиваем только после сверки, иначе свернём неполные корзины
+    compacted, removed = period_stats.compact() if periods_reconciled.is_set() else ([], [])
 
-# --- Совместимость: функция save_active_duels ---
-async def save_active_duels(bot):
+    # Запись в Supabase — пачкой, в фоне
+    stats_writer.count(winner_id, loser_id, buckets)
+    stats_writer.mark(winner_id, loser_id)
+    stats_writer.mark_periods(buckets + compacted, removed)
+    snapshot.schedule()
+
+# --- Отложенная запись статистики ---
+def add_delta(deltas, key, result):
+    delta = deltas.setdefault(key, [0, 0])
+    delta[0] += result[0]
+    delta[1] += result[1]
+
+class StatsWriter:
     """
-    Совместимость для старых модулей.
-    Сохраняет все активные дуэли в базу данных Supabase.
+    Write-behind буфер для duel_stats и duel_stats_periods: update_stats только
+    помечает изменённые строки, а раз в interval секунд они собираются из памяти
+    и уходят в outbox, который уже сам доставляет их в Supabase.
+    Строки одного игрока в outbox схлопываются, поэтому в базе всегда оказывается
+    последнее значение.
+    Пока таблица не сверена с базой, счёт в памяти может не включать строки из
+    базы (первый запуск без сети): такие строки не отправляются, а результаты
+    копятся как приращения и при сверке прибавляются к значениям из базы.
     """
-    from .data import active_duels, save_duel_to_db
 
-    for duel in list(active_duels.values()):
-        try:
-            await save_duel_to_db(duel, bot)
-        except Exception as e:
-            print(f"[save_active_duels] Ошибка при сохранении дуэли {duel.get('id', 'unknown')}: {e}")
+    def __init__(self, interval=5):
+        self.interval = interval
+        self.dirty = set()           # ключи игроков в duel_stats
+        self.dirty_periods = set()   # (bucket_id, ключ) в duel_stats_periods
+        self.removed_periods = set() # свёрнутые/устаревшие bucket_id
+        self.deltas = {}             # ключ -> [победы, поражения], засчитанные до сверки
+        self.period_deltas = {}      # (bucket_id, ключ) -> [победы, поражения] до сверки
+        self.task = None
+
+    @property
+    def pending(self):
+        return bool(self.dirty or self.dirty_periods or self.removed_periods)
+
+    def mark(self, *keys):
+        self.dirty.update(keys)
+        self.start()
+
+    def mark_periods(self, changed, removed=()):
+        self.dirty_periods.update(changed)
+        self.removed_periods.update(removed)
+        self.start()
+
+    def count(self, winner_id, loser_id, buckets):
+        """
+        Запоминает результат как приращение, пока его таблица не сверена.
+        Строка, уже ждущая записи без приращения, восстановлена из снимка
+        и новее базы — её значение в памяти и так окончательное.
+        """
+        (winner_bucket, _), (loser_bucket, _) = buckets
+        if not reconciled.is_set():
+            for key, result in ((winner_id, (1, 0)), (loser_id, (0, 1))):
+                if key not in self.dirty or key in self.deltas:
+                    add_delta(self.deltas, key, result)
+        if not periods_reconciled.is_set():
+            for pair, result in (((winner_bucket, winner_id), (1, 0)), ((loser_bucket, loser_id), (0, 1))):
+                if pair not in self.dirty_periods or pair in self.period_deltas:
+                    add_delta(self.period_deltas, pair, result)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        await asyncio.sleep(self.interval)
+        self.flush()
+
+    def flush(self):
+        """Переносит в outbox помеченные строки таблиц, уже сверенных с базой."""
+        keys, periods, removed = set(), set(), set()
+        if reconciled.is_set():
+            keys, self.dirty = self.dirty, set()
+        if periods_reconciled.is_set():
+            periods, self.dirty_periods = self.dirty_periods, set()
+            removed, self.removed_periods = self.removed_periods, set()
+        if not (keys or periods or removed):
+            return
+
+        for key in keys:
+            record = stats.get(key)
+            if record is None:
+                continue
+            outbox.upsert("duel_stats", {
+                "ID": key,
+                "Игрок": record.display_name,
+                "Побед": record.wins,
+                "Поражений": record.losses,
+                "Всего": record.total
+            }, key=key, on_conflict=["ID"])
+
+        for bucket_id, key in periods:
+            if key in period_stats.buckets.get(bucket_id, {}):
+                outbox.upsert("duel_stats_periods", period_stats.row(bucket_id, key),
+                              key=f"{bucket_id}:{key}", on_conflict=["Период", "ID"])
+
+        if removed:
+            # outbox отправляет по порядку: дни удаляются после записи их месяца
+            removed = sorted(removed)
+            outbox.delete("duel_stats_periods", [["in_", "Период", removed]], key=",".join(removed))
+
+        logger.info(
+            f"💾 Статистика поставлена в очередь записи: игроков {len(keys)}, "
+            f"строк по периодам {len(periods)}, удалено корзин {len(removed)}; в очереди {outbox.depth}"
+        )
+        snapshot.schedule()
+
+    async def close(self):
+        """Финальный перенос в outbox и попытка отправить очередь при выключении бота."""
+        if self.task is not None:
+            self.task.cancel()
+        self.flush()
+        await outbox.drain()
+
+
+stats_writer = StatsWriter()
+snapshot.collect = snapshot_state
+
+async def flush_stats():
+    await stats_writer.close()
+    await snapshot.save()
+
+# --- Запись изменённых дуэлей ---
+async def save_active_duels(bot=None):
+    """
+    Ставит в outbox только дуэли, изменённые с прошлого вызова.
+    Завершённые дуэли остаются в таблице со статусом DUEL_FINISHED и не загружаются.
+    """
+    changed, removed = active_duels.take_changes()
+    if not changed and not removed:
+        return
+
+    for duel_id, duel in changed.items():
+        row = duel_row(duel)
+        if row:
+            outbox.upsert("active_duels", row, key=duel_id, on_conflict=["Игрок 1 ID", "Игрок 2 ID"])
+    for duel_id, duel in removed.items():
+        row = duel_row(duel, status=DUEL_FINISHED)
+        if row:
+            outbox.upsert("active_duels", row, key=duel_id, on_conflict=["Игрок 1 ID", "Игрок 2 ID"])
+
+    logger.info(f"💾 Дуэли в очереди записи: изменено {len(changed)}, в архив {len(removed)}; в очереди {outbox.depth}")
+    snapshot.schedule()
 
 # --- Получение статистики ---
 async def get_stats():
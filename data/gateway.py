@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import time
+
+from supabase import acreate_client, AsyncClient
+from config import load_config
+from metrics import LatencyRegistry
+
+logger = logging.getLogger("supabase_gateway")
+
+config = load_config()
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлялся: Supabase (или таблица) сейчас считается недоступной."""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold ошибок подряд переходит в OPEN и сразу
+    отклоняет запросы, через reset_timeout пропускает один пробный запрос (HALF_OPEN).
+    Успех пробы закрывает его (CLOSED), ошибка — снова открывает.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.last_error = None
+        self.last_success = None
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.probing = False
+        if self.state == self.HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def retry_in(self):
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"✅ Supabase [{self.name}]: предохранитель закрыт")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probing = False
+        self.last_success = time.time()
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+        self.probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"🔌 Supabase [{self.name}]: предохранитель открыт на {self.reset_timeout} с ({self.last_error})")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def describe(self):
+        line = f"{self.state}, ошибок подряд {self.failures}"
+        if self.state == self.OPEN:
+            line += f", проба через {self.retry_in():.0f} с"
+        if self.last_error and self.state != self.CLOSED:
+            line += f", последняя ошибка: {self.last_error}"
+        return line
+
+
+def is_connection_error(error):
+    """Ошибка сети, а не конкретного запроса: таймаут, DNS, обрыв соединения."""
+    if isinstance(error, (asyncio.TimeoutError, OSError)):
+        return True
+    name = type(error).__name__
+    return any(part in name for part in ("Connect", "Timeout", "Network", "Transport"))
+
+
+def is_permanent_error(error):
+    """
+    Ошибка самого запроса, повтор которого ничего не изменит: 4xx от сервера
+    или ошибка Postgres в данных/схеме (ограничение, неверный столбец).
+    Сеть, таймауты, 5xx, 408/429 и открытый предохранитель — временные.
+    """
+    if isinstance(error, CircuitOpenError) or is_connection_error(error):
+        return False
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return 400 <= status < 500 and status not in (408, 429)
+    # postgrest APIError: SQLSTATE 22xxx — данные, 23xxx — ограничения, 42xxx — схема;
+    # PGRST1xx/2xx — неверный запрос или неизвестная таблица (PGRST0xx — нет связи с базой)
+    code = str(getattr(error, "code", None) or "")
+    return code[:2] in ("22", "23", "42") or (code.startswith("PGRST") and not code.startswith("PGRST0"))
+
+
+class SupabaseGateway:
+    """
+    Единая точка доступа к Supabase для всех модулей бота.
+    Один асинхронный клиент на процесс (HTTP-соединения переиспользуются),
+    таймаут на каждый запрос, ограничение одновременных запросов
+    и замеры задержек по таблицам. Ни один запрос не выполняется синхронно в event loop.
+    Общий предохранитель срабатывает на сетевые ошибки, у каждой таблицы — свой;
+    пока любой из них открыт, запрос сразу падает с CircuitOpenError.
+    """
+
+    def __init__(self, url, key, timeout=10, concurrency=4):
+        self.url = url
+        self.key = key
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.metrics = LatencyRegistry()  # scope — таблица, name — операция
+        self.errors = {}                  # (таблица, операция) -> число ошибок
+        self._client: AsyncClient | None = None
+        self._client_lock = asyncio.Lock()
+        self.breaker = CircuitBreaker("supabase")
+        self.table_breakers = {}  # таблица -> CircuitBreaker
+
+    def table_breaker(self, table):
+        breaker = self.table_breakers.get(table)
+        if breaker is None:
+            breaker = self.table_breakers[table] = CircuitBreaker(table)
+        return breaker
+
+    async def client(self) -> AsyncClient:
+        if self._client is None:
+            async with self._client_lock:
+                if self._client is None:
+                    self._client = await acreate_client(self.url, self.key)
+                    logger.info("🔌 Клиент Supabase создан")
+        return self._client
+
+    async def run(self, table, operation, build, timeout=None):
+        """
+        Выполняет запрос: build(client.table(table)) должен вернуть готовый builder.
+        Возвращает response.data; ошибки и таймауты пробрасываются вызывающему.
+        """
+        table_breaker = self.table_breaker(table)
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Supabase недоступен, повтор через {self.breaker.retry_in():.0f} с")
+        if not table_breaker.allow():
+            if self.breaker.probing:
+                self.breaker.probing = False  # проба общего предохранителя не состоялась
+            raise CircuitOpenError(f"Таблица {table} недоступна, повтор через {table_breaker.retry_in():.0f} с")
+
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                client = await self.client()
+                response = await asyncio.wait_for(
+                    build(client.table(table)).execute(),
+                    timeout=timeout or self.timeout
+                )
+            except Exception as e:
+                key = (table, operation)
+                self.errors[key] = self.errors.get(key, 0) + 1
+                if isinstance(e, asyncio.TimeoutError):
+                    logger.warning(f"⏳ Supabase: {operation} {table} не ответил за {timeout or self.timeout} с")
+                if is_connection_error(e):
+                    self.breaker.record_failure(e)
+                else:
+                    self.breaker.record_success()  # сервер ответил — сеть в порядке
+                table_breaker.record_failure(e)
+                raise
+            finally:
+                self.metrics.observe(table, operation, time.perf_counter() - started)
+
+        self.breaker.record_success()
+        table_breaker.record_success()
+        return response.data
+
+    async def select(self, table, columns="*", timeout=None):
+        return await self.run(table, "select", lambda query: query.select(columns), timeout)
+
+    async def select_pages(self, table, columns="*", order=(), page_size=500, timeout=None):
+        """
+        Асинхронный генератор строк таблицы: читает постранично через range,
+        так что в памяти одновременно только одна страница. order — столбцы
+        для стабильной сортировки между страницами. В конце пишет скорость загрузки.
+        """
+        started = time.perf_counter()
+        offset = total = 0
+        while True:
+            def build(query, offset=offset):
+                query = query.select(columns)
+                for column in order:
+                    query = query.order(column)
+                return query.range(offset, offset + page_size - 1)
+
+            rows = await self.run(table, "select_page", build, timeout)
+            for row in rows:
+                yield row
+            total += len(rows)
+            if len(rows) < page_size:
+                break
+            offset += page_size
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"📥 {table}: {total} строк за {elapsed:.2f} с ({total / elapsed if elapsed else 0:.0f} строк/с)")
+
+    async def upsert(self, table, rows, on_conflict, timeout=None):
+        if isinstance(on_conflict, (list, tuple)):
+            on_conflict = ",".join(on_conflict)
+        return await self.run(
+            table, "upsert", lambda query: query.upsert(rows, on_conflict=on_conflict), timeout
+        )
+
+    def health(self):
+        """Состояние предохранителей: общий и по таблицам."""
+        lines = [f"supabase: {self.breaker.describe()}"]
+        for table, breaker in sorted(self.table_breakers.items()):
+            lines.append(f"{table}: {breaker.describe()}")
+        return lines
+
+    def describe(self):
+        """Строки вида 'duel_stats.upsert: n=.. p50=..' для логов и диагностики."""
+        lines = []
+        for table, operations in self.metrics.scopes.items():
+            for operation, stats in operations.items():
+                errors = self.errors.get((table, operation), 0)
+                lines.append(f"{table}.{operation}: {stats.describe()}, ошибок {errors}")
+        return lines
+
+
+gateway = SupabaseGateway(
+    config["SUPABASE_URL"],
+    config["SUPABASE_KEY"],
+    timeout=config["SUPABASE_TIMEOUT"],
+    concurrency=config["SUPABASE_CONCURRENCY"],
+)
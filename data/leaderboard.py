@@ -0,0 +1,106 @@
+from bisect import bisect_left, insort
+
+
+class StatRecord:
+    """Статистика одного игрока в дуэлях."""
+    __slots__ = ("key", "display_name", "wins", "losses")
+
+    def __init__(self, key, display_name, wins=0, losses=0):
+        self.key = key
+        self.display_name = display_name
+        self.wins = wins
+        self.losses = losses
+
+    @property
+    def total(self):
+        return self.wins + self.losses
+
+    def sort_key(self):
+        # больше побед — выше; при равенстве меньше поражений, затем по ID
+        return (-self.wins, self.losses, self.key)
+
+
+class Leaderboard:
+    """
+    Хранилище StatRecord по ключу игрока и отсортированный индекс рейтинга.
+    Индекс — массив sort_key, который обновляется при каждом изменении записи,
+    поэтому место игрока ищется бинарным поиском, а топ и страницы — срезом,
+    без пересортировки всей статистики на каждый запрос.
+    """
+
+    def __init__(self):
+        self.records = {}  # key -> StatRecord
+        self.index = []    # отсортированные sort_key
+
+    # --- доступ как к словарю ---
+    def __getitem__(self, key):
+        return self.records[key]
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def get(self, key, default=None):
+        return self.records.get(key, default)
+
+    def items(self):
+        return self.records.items()
+
+    def values(self):
+        return self.records.values()
+
+    # --- изменение ---
+    def set(self, key, display_name, wins=0, losses=0):
+        """Создаёт или перезаписывает запись (загрузка из базы)."""
+        record = self.records.get(key)
+        if record is None:
+            record = self.records[key] = StatRecord(key, display_name, wins, losses)
+            insort(self.index, record.sort_key())
+            return record
+
+        self._unindex(record)
+        record.display_name = display_name
+        record.wins, record.losses = wins, losses
+        insort(self.index, record.sort_key())
+        return record
+
+    def add_result(self, key, display_name, wins=0, losses=0):
+        """Прибавляет победы/поражения игроку, создавая запись при необходимости."""
+        record = self.records.get(key)
+        if record is None:
+            return self.set(key, display_name, wins, losses)
+
+        self._unindex(record)
+        record.wins += wins
+        record.losses += losses
+        insort(self.index, record.sort_key())
+        return record
+
+    def _unindex(self, record):
+        del self.index[bisect_left(self.index, record.sort_key())]
+
+    # --- рейтинг ---
+    def rank(self, key):
+        """Место игрока (с 1) или None, если статистики нет."""
+        record = self.records.get(key)
+        if record is None:
+            return None
+        return bisect_left(self.index, record.sort_key()) + 1
+
+    def top(self, n, offset=0):
+        """Список (место, StatRecord) начиная с offset."""
+        return [
+            (offset + i + 1, self.records[sort_key[2]])
+            for i, sort_key in enumerate(self.index[offset:offset + n])
+        ]
+
+    def page(self, number, size=20):
+        """Страница рейтинга (с 1) и общее число страниц."""
+        pages = max(1, -(-len(self.index) // size))
+        number = min(max(1, number), pages)
+        return self.top(size, (number - 1) * size), pages
@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .gateway import is_permanent_error
+
+logger = logging.getLogger("outbox")
+
+
+class Outbox:
+    """
+    Надёжная очередь записей в Supabase.
+    Каждая запись сначала дописывается строкой в локальный JSONL-файл и только
+    потом отправляется, поэтому переживает обрыв сети и перезапуск бота.
+    Записи одной строки таблицы (один key) схлопываются — уходит только последняя.
+    Подряд идущие upsert в одну таблицу отправляются одним запросом; при ошибке
+    повтор с экспоненциальной паузой и случайным разбросом (jitter).
+    Запись, которую база отвергла окончательно (ограничение, неверный столбец),
+    уходит в файл *.dead и не задерживает очередь; при такой ошибке пачки
+    её записи отправляются по одной, чтобы отделить виновную от остальных.
+    Файл пишется в отдельном потоке, операции — строго в порядке вызова:
+    новые записи и подтверждения копятся и дописываются одним куском,
+    а пачка уходит в базу только после того, как её записи легли на диск.
+    """
+
+    def __init__(self, path, gateway, base_delay=2, max_delay=300, batch_size=500, compact_every=500):
+        self.path = path
+        self.dead_path = f"{path}.dead"
+        self.gateway = gateway
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.compact_every = compact_every
+        self.entries = OrderedDict()  # key -> запись, в порядке постановки
+        self.seq = 0
+        self.failures = 0
+        self.acked = 0                # подтверждённых записей с последнего сжатия файла
+        self.sent = 0
+        self.dead = 0                 # записей в файле *.dead
+        self.isolate = 0              # столько следующих записей отправить по одной
+        self.buffer = []              # строки, ещё не дописанные в файл
+        self.written = None           # future последней файловой операции
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        self.task = None
+
+    # --- файл ---
+    async def load(self):
+        """Восстанавливает неотправленные записи из файла (при старте)."""
+        loop = asyncio.get_running_loop()
+        self.dead, entries, acked = await loop.run_in_executor(self.executor, self._read)
+        if self.dead:
+            logger.warning(f"☠️ Outbox: {self.dead} отвергнутых базой записей в {self.dead_path}")
+        if entries is None:
+            return 0
+
+        for entry in entries:
+            self.seq = max(self.seq, entry["seq"])
+            if entry["seq"] in acked:
+                continue
+            self.entries.pop(entry["key"], None)
+            self.entries[entry["key"]] = entry
+
+        await self._compact()
+        if self.entries:
+            logger.info(f"📮 Outbox: {len(self.entries)} неотправленных записей с прошлого запуска")
+        return len(self.entries)
+
+    def _read(self):
+        try:
+            with open(self.dead_path, "r", encoding="utf-8") as f:
+                dead = sum(1 for line in f if line.strip())
+        except FileNotFoundError:
+            dead = 0
+
+        acked = set()
+        entries = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning("⚠️ Outbox: пропущена повреждённая строка")
+                        continue
+                    if "ack" in item:
+                        acked.update(item["ack"])
+                    else:
+                        entries.append(item)
+        except FileNotFoundError:
+            return dead, None, acked
+        return dead, entries, acked
+
+    def _submit(self, fn, *args):
+        """Ставит файловую операцию в поток outbox; выполняются по порядку вызова."""
+        self.written = asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        self.written.add_done_callback(self._check_written)
+        return self.written
+
+    def _check_written(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"⚠️ Outbox: не удалось обновить файл {self.path}: {future.exception()}")
+
+    def _write_later(self, item):
+        """Копит строку; всё накопленное за проход event loop дописывается одним куском."""
+        if not self.buffer:
+            asyncio.get_running_loop().call_soon(self._write_buffer)
+        self.buffer.append(json.dumps(item, ensure_ascii=False))
+
+    def _write_buffer(self):
+        if self.buffer:
+            lines, self.buffer = self.buffer, []
+            self._submit(self._append, lines)
+
+    async def flush(self):
+        """Дописывает накопленное и ждёт, пока файл догонит очередь в памяти."""
+        self._write_buffer()
+        if self.written is not None:
+            try:
+                await asyncio.shield(self.written)
+            except Exception:
+                pass  # ошибка уже записана в лог
+
+    def _compact(self):
+        """Сжимает файл до текущих записей; накопленные строки в него уже входят."""
+        self.buffer = []
+        self.acked = 0
+        return self._submit(self._rewrite, list(self.entries.values()))
+
+    def _append(self, lines):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _rewrite(self, entries):
+        """Временный файл + rename: на диске всегда целый файл."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def _append_dead(self, record):
+        os.makedirs(os.path.dirname(self.dead_path) or ".", exist_ok=True)
+        with open(self.dead_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    # --- постановка в очередь ---
+    def upsert(self, table, row, key, on_conflict):
+        self._put({"table": table, "op": "upsert", "row": row, "on_conflict": list(on_conflict)}, key)
+
+    def delete(self, table, filters, key):
+        """filters — список [метод, столбец, значение], например ["in_", "Период", [...]]."""
+        self._put({"table": table, "op": "delete", "filters": filters}, key)
+
+    def _put(self, entry, key):
+        self.seq += 1
+        entry["seq"] = self.seq
+        entry["key"] = f"{entry['table']}:{entry['op']}:{key}"
+        self.entries.pop(entry["key"], None)
+        self.entries[entry["key"]] = entry
+        self._write_later(entry)
+        self.start()
+
+    def has(self, table, op, key):
+        """Есть ли в очереди неотправленная запись этой строки."""
+        return f"{table}:{op}:{key}" in self.entries
+
+    def deleting(self, table, column):
+        """Значения column, строки с которыми ждут удаления в очереди (фильтры eq/in_)."""
+        values = set()
+        for entry in self.entries.values():
+            if entry["table"] != table or entry["op"] != "delete":
+                continue
+            for method, filter_column, value in entry["filters"]:
+                if filter_column != column:
+                    continue
+                if method == "in_":
+                    values.update(value)
+                elif method == "eq":
+                    values.add(value)
+        return values
+
+    @property
+    def depth(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {"depth": self.depth, "failures": self.failures, "sent": self.sent, "dead": self.dead}
+
+    # --- отправка ---
+    def start(self):
+        if self.entries and (self.task is None or self.task.done()):
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while self.entries:
+            # в базу уходит только то, что уже есть в файле
+            await self.flush()
+            if not self.entries:
+                break
+            batch = self._next_batch()
+            try:
+                await self._send(batch)
+            except Exception as e:
+                if is_permanent_error(e):
+                    self._reject(batch, e)
+                    continue
+                self.failures += 1
+                delay = min(self.base_delay * 2 ** (self.failures - 1), self.max_delay)
+                delay *= random.uniform(0.5, 1.5)
+                logger.error(
+                    f"⚠️ Outbox: запись в {batch[0]['table']} не удалась ({e}); "
+                    f"в очереди {self.depth}, повтор через {delay:.0f} с"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            if self.failures:
+                logger.info(f"✅ Outbox: связь с Supabase восстановлена, в очереди {self.depth - len(batch)}")
+            self.failures = 0
+            self._ack(batch)
+
+    def _reject(self, batch, error):
+        """Окончательный отказ базы: пачку разбираем по одной, одиночную запись — в *.dead."""
+        if len(batch) > 1:
+            logger.warning(f"⚠️ Outbox: {batch[0]['table']} отверг пачку из {len(batch)} ({error}), отправляем по одной")
+            self.isolate = len(batch)
+            return
+
+        entry = batch[0]
+        logger.error(f"☠️ Outbox: {entry['table']} отверг запись {entry['key']} ({error}), перенесена в {self.dead_path}")
+        self._submit(self._append_dead, {"entry": entry, "error": f"{type(error).__name__}: {error}", "at": time.time()})
+        self.dead += 1
+        self._ack(batch, sent=False)
+
+    def _next_batch(self):
+        entries = iter(self.entries.values())
+        first = next(entries)
+        batch = [first]
+        if self.isolate:
+            self.isolate -= 1
+            return batch
+        if first["op"] != "upsert":
+            return batch
+        for entry in entries:
+            if (len(batch) >= self.batch_size or entry["op"] != "upsert"
+                    or entry["table"] != first["table"] or entry["on_conflict"] != first["on_conflict"]):
+                break
+            batch.append(entry)
+        return batch
+
+    async def _send(self, batch):
+        first = batch[0]
+        if first["op"] == "upsert":
+            await self.gateway.upsert(first["table"], [entry["row"] for entry in batch], first["on_conflict"])
+            return
+
+        def build(query):
+            query = query.delete()
+            for method, column, value in first["filters"]:
+                query = getattr(query, method)(column, value)
+            return query
+
+        await self.gateway.run(first["table"], "delete", build)
+
+    def _ack(self, batch, sent=True):
+        done = []
+        for entry in batch:
+            # пока запрос шёл, строку могли перезаписать — тогда новая версия остаётся в очереди
+            if self.entries.get(entry["key"]) is entry:
+                del self.entries[entry["key"]]
+            done.append(entry["seq"])
+        if sent:
+            self.sent += len(batch)
+        self.acked += len(done)
+
+        if not self.entries or self.acked >= self.compact_every:
+            self._compact()
+        else:
+            self._write_later({"ack": done})
+
+    async def drain(self, timeout=10):
+        """Последняя попытка отправить очередь при выключении; остаток останется в файле."""
+        if self.task is not None and not self.task.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self.task), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.task.cancel()
+        await self.flush()
+        if self.entries:
+            logger.warning(f"📮 Outbox: {self.depth} записей не отправлено, будут отправлены при следующем запуске")
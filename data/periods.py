@@ -0,0 +1,140 @@
+from datetime import date, datetime, timedelta
+
+from config import default_timezone
+from .leaderboard import StatRecord
+
+# оконные рейтинги; «всё время» — это data.stats
+PERIODS = ("день", "неделя", "месяц")
+
+DAY_PREFIX = "d:"    # d:2026-10-18 — день
+MONTH_PREFIX = "m:"  # m:2026-10 — месяц, собранный из старых дней
+
+
+def bot_today():
+    """Сегодняшняя дата в часовом поясе бота — по ней делятся корзины дней."""
+    return datetime.now(default_timezone()).date()
+
+
+def day_id(day):
+    return f"{DAY_PREFIX}{day.isoformat()}"
+
+
+def month_id(year, month):
+    return f"{MONTH_PREFIX}{year:04d}-{month:02d}"
+
+
+def parse_bucket(bucket_id):
+    """'d:2026-10-18' -> date, 'm:2026-10' -> первое число месяца."""
+    if bucket_id.startswith(DAY_PREFIX):
+        return date.fromisoformat(bucket_id[len(DAY_PREFIX):])
+    year, month = bucket_id[len(MONTH_PREFIX):].split("-")
+    return date(int(year), int(month), 1)
+
+
+def period_start(period, today):
+    if period == "день":
+        return today
+    if period == "неделя":
+        return today - timedelta(days=today.weekday())
+    if period == "месяц":
+        return today.replace(day=1)
+    raise ValueError(f"Неизвестный период: {period}")
+
+
+class PeriodStats:
+    """
+    Предагрегированная статистика дуэлей по времени.
+    Каждый результат попадает в корзину своего дня; неделя и месяц считаются
+    суммой не более чем пары десятков корзин, без просмотра истории дуэлей.
+    Дни старше keep_days сворачиваются в корзины месяцев, месяцы старше
+    keep_months удаляются — общий счёт за всё время хранится в data.stats.
+    """
+
+    def __init__(self, keep_days=62, keep_months=12):
+        self.keep_days = keep_days
+        self.keep_months = keep_months
+        self.buckets = {}  # bucket_id -> {key: StatRecord}
+        self.compacted_on = None
+
+    def load_row(self, bucket_id, key, display_name, wins, losses):
+        self.buckets.setdefault(bucket_id, {})[key] = StatRecord(key, display_name, wins, losses)
+
+    def record(self, winner_key, winner_name, loser_key, loser_name, day=None):
+        """Учитывает дуэль в корзине дня. Возвращает изменённые пары (bucket_id, key)."""
+        bucket_id = day_id(day or bot_today())
+        bucket = self.buckets.setdefault(bucket_id, {})
+
+        for key, name, won in ((winner_key, winner_name, True), (loser_key, loser_name, False)):
+            record = bucket.get(key)
+            if record is None:
+                record = bucket[key] = StatRecord(key, name)
+            record.display_name = name
+            if won:
+                record.wins += 1
+            else:
+                record.losses += 1
+
+        return [(bucket_id, winner_key), (bucket_id, loser_key)]
+
+    def compact(self, today=None):
+        """
+        Сворачивает старые дни в месяцы и удаляет старые месяцы.
+        Возвращает (изменённые пары (bucket_id, key), удалённые bucket_id).
+        """
+        today = today or bot_today()
+        if self.compacted_on == today:
+            return [], []
+        self.compacted_on = today
+
+        day_cutoff = today - timedelta(days=self.keep_days)
+        month_cutoff = today.replace(day=1)
+        for _ in range(self.keep_months):
+            month_cutoff = (month_cutoff - timedelta(days=1)).replace(day=1)
+
+        changed, removed = [], []
+        for bucket_id in list(self.buckets):
+            start = parse_bucket(bucket_id)
+            if bucket_id.startswith(DAY_PREFIX) and start < day_cutoff:
+                target_id = month_id(start.year, start.month)
+                target = self.buckets.setdefault(target_id, {})
+                for key, record in self.buckets.pop(bucket_id).items():
+                    merged = target.get(key)
+                    if merged is None:
+                        merged = target[key] = StatRecord(key, record.display_name)
+                    merged.wins += record.wins
+                    merged.losses += record.losses
+                    changed.append((target_id, key))
+                removed.append(bucket_id)
+
+        for bucket_id in list(self.buckets):
+            if bucket_id.startswith(MONTH_PREFIX) and parse_bucket(bucket_id) < month_cutoff:
+                del self.buckets[bucket_id]
+                removed.append(bucket_id)
+
+        changed = [(bucket_id, key) for bucket_id, key in changed if bucket_id in self.buckets]
+        return changed, removed
+
+    def leaderboard(self, period, today=None):
+        """Отсортированный список StatRecord за период (день/неделя/месяц)."""
+        start = period_start(period, today or bot_today())
+        totals = {}
+        for bucket_id, bucket in self.buckets.items():
+            if parse_bucket(bucket_id) < start:
+                continue
+            for key, record in bucket.items():
+                total = totals.get(key)
+                if total is None:
+                    total = totals[key] = StatRecord(key, record.display_name)
+                total.wins += record.wins
+                total.losses += record.losses
+        return sorted(totals.values(), key=StatRecord.sort_key)
+
+    def row(self, bucket_id, key):
+        record = self.buckets[bucket_id][key]
+        return {
+            "Период": bucket_id,
+            "ID": key,
+            "Игрок": record.display_name,
+            "Побед": record.wins,
+            "Поражений": record.losses,
+        }
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger("snapshot")
+
+
+class Snapshot:
+    """
+    Локальная копия состояния из Supabase в одном JSON-файле.
+    Бот стартует с неё сразу, не дожидаясь сети; запись отложенная
+    (debounce) и идёт в отдельном потоке через временный файл + rename,
+    чтобы при падении на диске не остался обрезанный JSON.
+    """
+
+    def __init__(self, path, debounce=2):
+        self.path = path
+        self.debounce = debounce
+        self.state = {}
+        self.collect = None  # функция, собирающая актуальное состояние для записи
+        self.task = None
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+            logger.info(f"📦 Локальный снимок загружен: {self.path}")
+        except FileNotFoundError:
+            self.state = {}
+        except Exception as e:
+            logger.error(f"⚠️ Снимок {self.path} повреждён, начинаем с пустого: {e}")
+            self.state = {}
+        return self.state
+
+    def table(self, name):
+        """(строки, время обновления) закэшированной таблицы или (None, 0)."""
+        entry = self.state.get("tables", {}).get(name)
+        if not entry:
+            return None, 0
+        return entry["rows"], entry["updated_at"]
+
+    def set_table(self, name, rows):
+        self.state.setdefault("tables", {})[name] = {"rows": rows, "updated_at": time.time()}
+        self.schedule()
+
+    def schedule(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.debounce)
+        await self.save()
+
+    async def save(self):
+        if self.collect is not None:
+            self.state.update(self.collect())
+        payload = json.dumps(self.state, ensure_ascii=False)
+        try:
+            await asyncio.to_thread(self._write, payload)
+        except Exception as e:
+            logger.error(f"⚠️ Не удалось записать снимок {self.path}: {e}")
+
+    def _write(self, payload):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from config import load_config
+
+logger = logging.getLogger("local_store")
+
+
+class LocalStore:
+    """
+    Локальное хранилище состояния модулей (подписки, напоминания, ID сообщений).
+    SQLite в режиме WAL; значения — JSON, сгруппированные по namespace.
+    Все обращения к базе идут в одном отдельном потоке, поэтому event loop
+    не ждёт диска, а запросы выполняются строго по очереди.
+    Каждая запись — отдельная транзакция: при падении на диске остаётся
+    либо старое, либо новое состояние целиком.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-store")
+        self.conn = None
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def _connection(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)")
+            self.conn = conn
+            logger.info(f"🗄 Локальное хранилище открыто: {self.path}")
+        return self.conn
+
+    # --- чтение ---
+    def _items(self, namespace):
+        rows = self._connection().execute(
+            "SELECT key, value FROM kv WHERE namespace = ?", (namespace,)
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def _get(self, namespace, key, default):
+        row = self._connection().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, str(key))
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    async def items(self, namespace):
+        """Все записи namespace: {key: value} (ключи — строки)."""
+        return await self._call(self._items, namespace)
+
+    async def get(self, namespace, key, default=None):
+        return await self._call(self._get, namespace, key, default)
+
+    # --- запись ---
+    def _write(self, namespace, upserts, deletes):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO kv (namespace, key, value) VALUES (?, ?, ?)"
+                " ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value",
+                [(namespace, str(key), json.dumps(value, ensure_ascii=False)) for key, value in upserts.items()]
+            )
+            conn.executemany(
+                "DELETE FROM kv WHERE namespace = ? AND key = ?",
+                [(namespace, str(key)) for key in deletes]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def write(self, namespace, upserts=None, deletes=()):
+        """Изменяет несколько ключей namespace одной транзакцией."""
+        await self._call(self._write, namespace, upserts or {}, list(deletes))
+
+    async def set(self, namespace, key, value):
+        await self.write(namespace, {key: value})
+
+    async def delete(self, namespace, *keys):
+        await self.write(namespace, deletes=keys)
+
+    # --- перенос старых файлов ---
+    def _import_file(self, namespace, path, convert):
+        conn = self._connection()
+        name = f"{namespace}:{os.path.basename(path)}"
+        if conn.execute("SELECT 1 FROM migrations WHERE name = ?", (name,)).fetchone():
+            return 0
+        if not os.path.exists(path):
+            conn.execute("INSERT OR IGNORE INTO migrations (name) VALUES (?)", (name,))
+            return 0
+
+        with open(path, "r", encoding="utf-8") as f:
+            upserts = convert(f.read())
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+                [(namespace, str(key), json.dumps(value, ensure_ascii=False)) for key, value in upserts.items()]
+            )
+            conn.execute("INSERT INTO migrations (name) VALUES (?)", (name,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        os.replace(path, f"{path}.migrated")
+        return len(upserts)
+
+    async def import_file(self, namespace, path, convert):
+        """
+        Однократно переносит старый файл в namespace: convert(текст) -> {key: value}.
+        После успешной транзакции файл переименовывается в *.migrated.
+        """
+        try:
+            count = await self._call(self._import_file, namespace, path, convert)
+            if count:
+                logger.info(f"🗄 {path} перенесён в хранилище ({namespace}): {count} записей")
+        except Exception as e:
+            logger.error(f"⚠️ Не удалось перенести {path} в хранилище: {e}")
+
+    async def close(self):
+        def _close():
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+        await self._call(_close)
+        self.executor.shutdown(wait=False)
+
+
+store = LocalStore(load_config()["LOCAL_STORE_PATH"])
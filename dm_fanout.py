@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import random
+import time
+
+import aiohttp
+import discord
+
+from config import load_config
+from data import store
+from metrics import LatencyRegistry
+
+logger = logging.getLogger("dm_fanout")
+
+config = load_config()
+
+CANNOT_MESSAGE_USER = 50007  # код Discord: пользователь закрыл личные сообщения
+
+
+class DMFanout:
+    """
+    Рассылка личных сообщений списку пользователей.
+    Пользователь берётся из кэша бота, REST-запрос fetch_user — только если его там нет.
+    Отправка идёт параллельно, но не больше limit сообщений одновременно:
+    при ответе 429 вся рассылка ждёт retry_after из заголовков Discord, а limit
+    уменьшается вдвое и потом по одному восстанавливается после успешных отправок.
+    Временные ошибки (429, 5xx, сеть) повторяются с экспоненциальной паузой;
+    закрытые личные сообщения запоминаются в локальном хранилище на closed_ttl
+    и в следующих рассылках пропускаются без запроса.
+    """
+
+    def __init__(self, concurrency=5, retries=3, closed_ttl=7 * 24 * 3600):
+        self.max_limit = max(1, concurrency)
+        self.limit = self.max_limit
+        self.retries = retries
+        self.closed_ttl = closed_ttl
+        self.active = 0
+        self.resume_at = 0.0
+        self.successes = 0
+        self.condition = asyncio.Condition()
+        self.closed = None  # user_id -> время, когда получили отказ
+        self.metrics = LatencyRegistry()  # scope — название рассылки
+
+    # --- закрытые ЛС ---
+    async def _load_closed(self):
+        if self.closed is None:
+            self.closed = {}
+            try:
+                self.closed = {int(uid): since for uid, since in (await store.items("dm_closed")).items()}
+            except Exception as e:
+                logger.error(f"⚠️ Не удалось загрузить список закрытых ЛС: {e}")
+
+    def is_closed(self, user_id):
+        since = self.closed.get(user_id)
+        return since is not None and time.time() - since < self.closed_ttl
+
+    async def _mark_closed(self, user_id):
+        self.closed[user_id] = time.time()
+        try:
+            await store.set("dm_closed", user_id, self.closed[user_id])
+        except Exception as e:
+            logger.error(f"⚠️ Не удалось сохранить закрытые ЛС {user_id}: {e}")
+
+    # --- ограничение параллельности ---
+    async def _acquire(self):
+        async with self.condition:
+            while True:
+                wait = self.resume_at - time.monotonic()
+                if wait <= 0 and self.active < self.limit:
+                    self.active += 1
+                    return
+                try:
+                    await asyncio.wait_for(self.condition.wait(), wait if wait > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _release(self, ok):
+        async with self.condition:
+            self.active -= 1
+            if ok:
+                self.successes += 1
+                if self.limit < self.max_limit and self.successes >= self.limit * 4:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+    async def _rate_limited(self, retry_after):
+        async with self.condition:
+            self.resume_at = max(self.resume_at, time.monotonic() + retry_after)
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+        logger.warning(f"🚦 DM: лимит Discord, пауза {retry_after:.1f} с, одновременно не больше {self.limit}")
+
+    # --- отправка ---
+    async def send(self, bot, recipients, content, name="dm"):
+        """
+        Рассылает content получателям (ID, User или Member; повторы убираются).
+        content — строка или функция user -> строка.
+        Возвращает {"sent", "failed", "closed"} и пишет в лог итог с перцентилями задержки.
+        """
+        await self._load_closed()
+        started = time.perf_counter()
+        result = {"sent": 0, "failed": 0, "closed": 0}
+
+        targets = {}
+        for recipient in recipients:
+            user_id = recipient if isinstance(recipient, int) else recipient.id
+            targets.setdefault(user_id, recipient)
+
+        async def deliver(user_id, recipient):
+            if self.is_closed(user_id):
+                result["closed"] += 1
+                return
+            status = await self._deliver(bot, user_id, recipient, content)
+            result[status] += 1
+            if status == "sent":
+                self.metrics.observe(name, "delivery", time.perf_counter() - started)
+
+        await asyncio.gather(*(deliver(user_id, recipient) for user_id, recipient in targets.items()))
+
+        stats = self.metrics.get(name).get("delivery")
+        logger.info(
+            f"📊 DM {name} | sent={result['sent']} failed={result['failed']} closed={result['closed']} "
+            f"за {time.perf_counter() - started:.1f} с | {stats.describe() if stats else 'нет данных'}"
+        )
+        return result
+
+    async def _deliver(self, bot, user_id, recipient, content):
+        for attempt in range(self.retries + 1):
+            await self._acquire()
+            ok = False
+            try:
+                user = recipient
+                if isinstance(user, int):
+                    user = bot.get_user(user_id) or await bot.fetch_user(user_id)
+                    recipient = user  # при повторе не запрашиваем снова
+                await user.send(content(user) if callable(content) else content)
+                ok = True
+                return "sent"
+            except discord.Forbidden as e:
+                if e.code == CANNOT_MESSAGE_USER:
+                    await self._mark_closed(user_id)
+                    return "closed"
+                logger.warning(f"DM {user_id}: нет доступа ({e})")
+                return "failed"
+            except discord.NotFound:
+                logger.warning(f"DM {user_id}: пользователь не найден")
+                return "failed"
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    await self._rate_limited(getattr(e, "retry_after", None) or 1.0)
+                elif e.status < 500:
+                    logger.warning(f"DM {user_id}: ошибка {e.status} ({e})")
+                    return "failed"
+                error = e
+            except (asyncio.TimeoutError, aiohttp.ClientError, OSError) as e:
+                error = e
+            finally:
+                await self._release(ok)
+
+            if attempt < self.retries:
+                await asyncio.sleep(0.5 * 2 ** attempt * random.uniform(0.5, 1.5))
+
+        logger.warning(f"DM {user_id}: не доставлено после {self.retries + 1} попыток ({error})")
+        return "failed"
+
+    def describe(self):
+        """Строки 'рассылка: n=.. p50=..' для диагностики."""
+        return [
+            f"{name}: {stats.describe()}"
+            for name, metrics in self.metrics.scopes.items()
+            for stats in metrics.values()
+        ]
+
+
+fanout = DMFanout(concurrency=config["DM_CONCURRENCY"], retries=config["DM_RETRIES"])
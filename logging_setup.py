@@ -1,12 +1,13 @@
+import asyncio
 import logging
 import sys
 import os
-import threading
-import time
 
 from datetime import datetime, timedelta
 from github import Github, GithubException
 
+from scheduler import scheduler
+
 
 class ColorFormatter(logging.Formatter):
     COLORS = {
@@ -158,49 +159,39 @@ def smart_rotate_and_push(log_dir, log_name, config):
     return today_file
 
 
-def schedule_midnight_push(config):
-    last_run = None
-
-    def worker():
-        nonlocal last_run
-
-        while True:
-            now = datetime.now()
-            today = now.date()
+def push_day_log(day, config):
+    """Отправляет лог за день day в GitHub и удаляет его локально."""
+    day = day.strftime("%Y-%m-%d")
+    log_path = os.path.join("logs", f"bot_{day}.log")
 
-            # Если наступила полночь и мы ещё не отправляли сегодня
-            if now.hour == 0 and now.minute == 0 and last_run != today:
-                last_run = today
+    if not os.path.exists(log_path):
+        github_logger.log_push(f"⚠️ Вчерашний лог не найден: {log_path}")
+        return
 
-                # Отправляем лог за ВЧЕРАШНИЙ день
-                yesterday = (now - timedelta(days=1)).strftime("%Y-%m-%d")
-                log_path = os.path.join("logs", f"bot_{yesterday}.log")
+    github_logger.log_push(f"🌙 Ночной пуш (вчерашний лог): {log_path}")
 
-                if os.path.exists(log_path):
-                    github_logger.log_push(f"🌙 Ночной пуш (вчерашний лог): {log_path}")
+    success = push_log_to_github(log_path, f"bot_{day}.log", config)
 
-                    success = push_log_to_github(
-                        log_path,
-                        f"bot_{yesterday}.log",
-                        config
-                    )
-
-                    if success:
-                        try:
-                            os.remove(log_path)
-                            github_logger.log_push(f"🗑 Удалён после пуша: {log_path}")
-                        except Exception as e:
-                            github_logger.log_push(f"❌ Не удалось удалить: {e}")
-                else:
-                    github_logger.log_push(f"⚠️ Вчерашний лог не найден: {log_path}")
+    if success:
+        try:
+            os.remove(log_path)
+            github_logger.log_push(f"🗑 Удалён после пуша: {log_path}")
+        except Exception as e:
+            github_logger.log_push(f"❌ Не удалось удалить: {e}")
 
-                # Небольшая задержка, чтобы не сработать повторно в ту же секунду
-                time.sleep(60)
 
-            time.sleep(1)
+async def schedule_midnight_push(config):
+    """
+    Каждую полночь отправляет лог за вчерашний день (через общий планировщик).
+    Файлы логов называются по системным часам, поэтому и полночь — системная,
+    а не BOT_TIMEZONE.
+    """
+    async def push(when):
+        # GitHub API синхронный — выполняем в отдельном потоке
+        await asyncio.to_thread(push_day_log, when.astimezone() - timedelta(days=1), config)
 
-    thread = threading.Thread(target=worker, daemon=True)
-    thread.start()
+    host_tz = datetime.now().astimezone().tzinfo
+    await scheduler.daily("logs:midnight_push", push, hour=0, tz=host_tz, grace=3600)
 
 
 def setup_logging(config, log_level=logging.INFO):
@@ -241,6 +232,4 @@ def setup_logging(config, log_level=logging.INFO):
 
     logging.Logger.success = success
 
-    schedule_midnight_push(config)
-
     return root
\ No newline at end of file
@@ -4,7 +4,8 @@ import asyncio
 from discord.ext import commands
 from discord import Intents
 from config import load_config
-from logging_setup import setup_logging
+from logging_setup import setup_logging, schedule_midnight_push
+from scheduler import scheduler
 import data  # ленивый кэш
 import traceback
 import os, sys
@@ -63,6 +64,7 @@ async def main():
     """Главная точка входа."""
     config = load_config()
     setup_logging(config)
+    await schedule_midnight_push(config)
 
     token = config.get("DISCORD_TOKEN")
     if not token:
@@ -85,6 +87,10 @@ async def main():
         logger.critical("❌ Неверный Discord токен.")
     except Exception as e:
         logger.critical(f"🔥 Критическая ошибка при запуске: {e}")
+    finally:
+        scheduler.stop()
+        # дописываем отложенную статистику дуэлей
+        await data.flush_stats()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+import time
+from collections import deque
+
+
+class LatencyStats:
+    """Скользящее окно последних измерений (в секундах) с перцентилями."""
+    __slots__ = ("samples", "count")
+
+    def __init__(self, window=500):
+        self.samples = deque(maxlen=window)
+        self.count = 0  # всего измерений за время работы, а не только в окне
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, p):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": max(self.samples) if self.samples else None,
+        }
+
+    def describe(self):
+        """Короткая строка для логов и embed: n=12 p50=0.41с p90=1.20с p99=2.05с"""
+        if not self.samples:
+            return "нет данных"
+        s = self.summary()
+        return f"n={s['count']} p50={s['p50']:.2f}с p90={s['p90']:.2f}с p99={s['p99']:.2f}с"
+
+
+class LatencyRegistry:
+    """Набор LatencyStats, сгруппированных по области (сервер, таблица) и имени метрики."""
+
+    def __init__(self, window=500):
+        self.window = window
+        self.scopes = {}  # scope -> {name: LatencyStats}
+
+    def observe(self, scope, name, seconds):
+        metrics = self.scopes.setdefault(scope, {})
+        if name not in metrics:
+            metrics[name] = LatencyStats(self.window)
+        metrics[name].add(seconds)
+
+    def get(self, scope):
+        return self.scopes.get(scope, {})
+
+    def span(self, scope, name):
+        return Span(self, scope, name)
+
+
+class Span:
+    """with registry.span(scope, "name"): ... — замеряет блок и пишет результат в registry."""
+    __slots__ = ("registry", "scope", "name", "started")
+
+    def __init__(self, registry, scope, name):
+        self.registry = registry
+        self.scope = scope
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.scope, self.name, time.perf_counter() - self.started)
+        return False
@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, time as dtime, timedelta, timezone
+
+from config import default_timezone
+from data import store
+
+logger = logging.getLogger("scheduler")
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+class CronTrigger:
+    """
+    Упрощённый cron: наборы минут, часов и дней недели (0 — понедельник).
+    None означает «любой». Время считается в часовом поясе tz.
+    """
+
+    def __init__(self, minute=0, hour=None, weekday=None, tz=None):
+        self.minutes = self._values(minute, range(60))
+        self.hours = self._values(hour, range(24))
+        self.weekdays = self._values(weekday, range(7))
+        self.tz = tz or default_timezone()
+
+    @staticmethod
+    def _values(value, full):
+        if value is None:
+            return sorted(full)
+        if isinstance(value, int):
+            return [value]
+        return sorted(set(value))
+
+    def next_after(self, moment):
+        """Ближайшее срабатывание строго позже moment (aware datetime), в UTC."""
+        local = moment.astimezone(self.tz)
+        for offset in range(8):
+            day = local.date() + timedelta(days=offset)
+            if day.weekday() not in self.weekdays:
+                continue
+            for hour in self.hours:
+                for minute in self.minutes:
+                    candidate = datetime.combine(day, dtime(hour, minute), tzinfo=self.tz)
+                    if candidate > moment:
+                        return candidate.astimezone(timezone.utc)
+        return None
+
+    def describe(self):
+        def part(values, full):
+            return "*" if len(values) == full else ",".join(map(str, values))
+        return f"cron {part(self.minutes, 60)} {part(self.hours, 24)} {part(self.weekdays, 7)} ({self.tz})"
+
+
+class OnceTrigger:
+    def __init__(self, when):
+        self.when = when if when.tzinfo else when.replace(tzinfo=default_timezone())
+
+    def next_after(self, moment):
+        return None  # после первого запуска задача удаляется
+
+    def describe(self):
+        return f"однократно {self.when.astimezone(default_timezone()):%Y-%m-%d %H:%M}"
+
+
+class Job:
+    __slots__ = (
+        "name", "func", "trigger", "grace", "persist", "next_run",
+        "last_run", "runs", "missed", "errors", "running", "cancelled",
+    )
+
+    def __init__(self, name, func, trigger, grace, persist):
+        self.name = name
+        self.func = func          # async func(scheduled_at)
+        self.trigger = trigger
+        self.grace = grace        # сколько секунд опоздания ещё допустимо для запуска
+        self.persist = persist    # хранить время последнего запуска между перезапусками
+        self.next_run = None
+        self.last_run = None
+        self.runs = 0
+        self.missed = 0
+        self.errors = 0
+        self.running = False
+        self.cancelled = False
+
+
+class Scheduler:
+    """
+    Общий планировщик задач бота вместо опроса часов в tasks.loop.
+    Задачи лежат в куче по времени следующего запуска; цикл спит до ближайшего
+    срока (не дольше max_sleep, чтобы заметить перевод системных часов).
+    Если срок прошёл, пока бот был занят или переподключался, задача всё равно
+    выполняется один раз — пропущенные повторы схлопываются, а опоздание больше
+    grace считается пропуском. Для повторяющихся задач время последнего запуска
+    хранится в локальном хранилище, так что после перезапуска бота пропущенный
+    в пределах grace запуск тоже догоняется, а уже выполненный не повторяется.
+    """
+
+    def __init__(self, max_sleep=60):
+        self.max_sleep = max_sleep
+        self.jobs = {}   # name -> Job
+        self.heap = []   # (next_run, порядковый номер, Job)
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    # --- регистрация ---
+    async def cron(self, name, func, minute=0, hour=None, weekday=None, tz=None, grace=300):
+        """Повторяющаяся задача по расписанию в стиле cron; grace=None — догонять при любом опоздании."""
+        return await self._add(Job(name, func, CronTrigger(minute, hour, weekday, tz), grace, True))
+
+    async def daily(self, name, func, hour, minute=0, tz=None, grace=300):
+        """Ежедневная задача в hour:minute по часовому поясу tz."""
+        return await self.cron(name, func, minute=minute, hour=hour, tz=tz, grace=grace)
+
+    async def once(self, name, func, when, grace=None):
+        """Однократная задача; по умолчанию выполняется при любом опоздании."""
+        job = Job(name, func, OnceTrigger(when), grace, False)
+        job.next_run = job.trigger.when.astimezone(timezone.utc)
+        return await self._add(job)
+
+    async def _add(self, job):
+        self.cancel(job.name)
+        if job.next_run is None:
+            now = utcnow()
+            since = now
+            if job.persist:
+                last_run = await store.get("scheduler", job.name)
+                if last_run:
+                    job.last_run = datetime.fromisoformat(last_run)
+                    since = job.last_run
+                    if job.grace is not None:
+                        since = max(since, now - timedelta(seconds=job.grace))
+            job.next_run = job.trigger.next_after(since)
+
+        self.jobs[job.name] = job
+        self._push(job)
+        self.start()
+        logger.debug(f"🗓 Задача {job.name}: {job.trigger.describe()}, следующий запуск {job.next_run}")
+        return job
+
+    def cancel(self, name):
+        """Снимает задачу; её запись в куче пропускается при извлечении."""
+        job = self.jobs.pop(name, None)
+        if job is not None:
+            job.cancelled = True
+        return job is not None
+
+    def _push(self, job):
+        if job.next_run is None:
+            self.jobs.pop(job.name, None)
+            return
+        heapq.heappush(self.heap, (job.next_run, next(self.counter), job))
+        self.wakeup.set()
+
+    # --- цикл ---
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        while True:
+            while self.heap and self.heap[0][2].cancelled:
+                heapq.heappop(self.heap)
+
+            if self.heap:
+                delay = (self.heap[0][0] - utcnow()).total_seconds()
+            else:
+                delay = self.max_sleep
+
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), min(delay, self.max_sleep))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            scheduled, _, job = heapq.heappop(self.heap)
+            self._fire(job, scheduled)
+
+    def _fire(self, job, scheduled):
+        now = utcnow()
+        late = (now - scheduled).total_seconds()
+
+        # пропущенные повторы схлопываются в один запуск
+        job.next_run = job.trigger.next_after(max(scheduled, now))
+
+        if job.grace is not None and late > job.grace:
+            job.missed += 1
+            logger.warning(f"⏰ Задача {job.name}: пропущен запуск {scheduled:%Y-%m-%d %H:%M} UTC (опоздание {late:.0f} с)")
+        elif job.running:
+            job.missed += 1
+            logger.warning(f"⏰ Задача {job.name}: предыдущий запуск ещё не закончился, пропускаем")
+        else:
+            if late > 1:
+                logger.info(f"⏰ Задача {job.name}: запуск с опозданием {late:.0f} с")
+            asyncio.create_task(self._execute(job, scheduled))
+
+        self._push(job)
+
+    async def _execute(self, job, scheduled):
+        job.running = True
+        try:
+            await job.func(scheduled.astimezone(default_timezone()))
+            job.runs += 1
+        except Exception as e:
+            job.errors += 1
+            logger.exception(f"❌ Задача {job.name} завершилась с ошибкой: {e}")
+        finally:
+            job.running = False
+            job.last_run = scheduled
+            if job.persist:
+                try:
+                    await store.set("scheduler", job.name, scheduled.isoformat())
+                except Exception as e:
+                    logger.error(f"⚠️ Не удалось сохранить время запуска {job.name}: {e}")
+
+    # --- диагностика ---
+    def describe(self):
+        """Таблица задач: имя, расписание, следующий запуск и счётчики."""
+        tz = default_timezone()
+        lines = []
+        for job in sorted(self.jobs.values(), key=lambda job: job.next_run):
+            line = f"{job.name}: {job.trigger.describe()}, далее {job.next_run.astimezone(tz):%d.%m %H:%M}"
+            line += f", запусков {job.runs}"
+            if job.missed:
+                line += f", пропущено {job.missed}"
+            if job.errors:
+                line += f", ошибок {job.errors}"
+            lines.append(line)
+        return lines
+
+
+scheduler = Scheduler()